@@ -1,11 +1,14 @@
-from crewai import Agent, Task,LLM, Crew, Process
-from langchain_ollama import ChatOllama
 import json
+import os
+from typing import List, Literal
+from pydantic import BaseModel, Field
 
-llm = LLM(
-    model="ollama/llama3.1", 
-    base_url="http://localhost:11434"
-)
+MODEL = "ollama/llama3.1"
+BASE_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+
+# Ask Ollama to constrain replies to each task's JSON schema. Needs Ollama
+# 0.5+; set OLLAMA_STRUCTURED_OUTPUT=0 for older servers.
+STRUCTURED_OUTPUT = os.environ.get("OLLAMA_STRUCTURED_OUTPUT", "1") != "0"
 
 CATEGORIES = [
     "Groceries",
@@ -20,39 +23,108 @@ CATEGORIES = [
 ]
 
 
+# Reply shapes, sent to Ollama as JSON schemas when STRUCTURED_OUTPUT is on
+class ReceiptCategory(BaseModel):
+    image_file: str
+    category: Literal[tuple(CATEGORIES)]
+    confidence: int = Field(ge=0, le=100)
+    reasoning: str
+
+
+class CategorizationReply(BaseModel):
+    receipts: List[ReceiptCategory]
+
+
+class ItemCategory(BaseModel):
+    description: str
+    category: str
+
+
+class ItemCategorizationReply(BaseModel):
+    items: List[ItemCategory]
+
+
+class AnalysisReply(BaseModel):
+    insights: List[str]
+    anomalies: List[str]
+
+
+class AdviceReply(BaseModel):
+    budget_status: Literal["on track", "over budget", "under budget"]
+    tips: List[str]
+    quick_win: str
+    positive: str
+
+
+# CrewAI takes seconds to import, so it is imported and the LLM clients are
+# built only when an agent is first needed. One client per reply model.
+_llms = {}
+
+
+def json_llm(reply_model=None):
+    from crewai import LLM
+
+    if not STRUCTURED_OUTPUT:
+        reply_model = None
+    if reply_model not in _llms:
+        options = {"response_format": reply_model} if reply_model else {}
+        _llms[reply_model] = LLM(
+            model=MODEL,
+            base_url=BASE_URL,
+            **options
+        )
+    return _llms[reply_model]
+
+
 class ExpenseAgents:
-    def __init__(self):
-        self.llm = llm
+    @property
+    def llm(self):
+        return json_llm()
     
     def categorizer_agent(self):
+        from crewai import Agent
         return Agent(
             role="Expense Categorization Expert",
             goal="Accurately categorize receipts into appropriate spending categories",
             backstory="""You are an expert at analyzing receipts and categorizing expenses.
             You understand context and always return valid JSON.""",
-            llm=self.llm,
+            llm=json_llm(CategorizationReply),
+            verbose=True,
+            allow_delegation=False
+        )
+    
+    def item_categorizer_agent(self):
+        from crewai import Agent
+        return Agent(
+            role="Grocery Item Classifier",
+            goal="Assign each receipt line item a short product category",
+            backstory="""You know store product codes and abbreviated receipt item names.
+            You always return valid JSON.""",
+            llm=json_llm(ItemCategorizationReply),
             verbose=True,
             allow_delegation=False
         )
     
     def analyzer_agent(self):
+        from crewai import Agent
         return Agent(
             role="Spending Pattern Analyst",
             goal="Identify spending trends and patterns",
             backstory="""You are a financial analyst who finds patterns in spending data.
             You always return structured JSON with insights.""",
-            llm=self.llm,
+            llm=json_llm(AnalysisReply),
             verbose=True,
             allow_delegation=False
         )
     
     def advisor_agent(self):
+        from crewai import Agent
         return Agent(
             role="Personal Finance Advisor",
             goal="Provide actionable budgeting advice for students",
             backstory="""You are a financial advisor for students. 
             You provide practical tips in JSON format.""",
-            llm=self.llm,
+            llm=json_llm(AdviceReply),
             verbose=True,
             allow_delegation=False
         )
@@ -65,6 +137,7 @@ class ExpenseTasks:
             for e in expenses
         ])
         
+        from crewai import Task
         return Task(
             description=f"""Categorize these receipts:
             
@@ -74,39 +147,56 @@ class ExpenseTasks:
             
             Return ONLY valid JSON (no markdown, no explanation):
             {{
-              "receipt1.jpg": {{
-                "category": "Groceries",
-                "confidence": 95,
-                "reasoning": "brief reason"
-              }}
+              "receipts": [
+                {{
+                  "image_file": "receipt1.jpg",
+                  "category": "Groceries",
+                  "confidence": 95,
+                  "reasoning": "brief reason"
+                }}
+              ]
             }}
             """,
             agent=agent,
             expected_output="Valid JSON object with categorization"
         )
     
-    def analyze_task(self, agent, expenses, categorization):
-        by_category = {}
-        total_spent = 0
+    def categorize_items_task(self, agent, descriptions, known_categories):
+        items_text = "\n".join(f"- {json.dumps(d)}" for d in descriptions)
         
-        for e in expenses:
-            img = e['image_file']
-            cat = categorization.get(img, {}).get('category', 'Other')
+        from crewai import Task
+        return Task(
+            description=f"""Categorize these receipt line items:
+            
+            {items_text}
             
-            # Safely handle None values
-            expense_total = e.get('total')
-            if expense_total is None:
-                expense_total = 0
+            Give each item a short product category. Prefer one of these when it fits:
+            {', '.join(known_categories)}
             
-            by_category[cat] = by_category.get(cat, 0) + expense_total
-            total_spent += expense_total
+            Copy each description exactly as given.
+            
+            Return ONLY valid JSON (no markdown, no explanation):
+            {{
+              "items": [
+                {{"description": "BANANAS ORGANIC", "category": "Fresh produce"}}
+              ]
+            }}
+            """,
+            agent=agent,
+            expected_output="Valid JSON object with item categories"
+        )
+    
+    def analyze_task(self, agent, summary):
+        by_category = summary['by_category']
+        total_spent = summary['total_spent']
         
         analysis_data = f"""
         Total spent: ₹{total_spent:.2f}
         By category: {json.dumps(by_category, indent=2)}
-        Number of receipts: {len(expenses)}
+        Number of receipts: {summary['count']}
         """
         
+        from crewai import Task
         return Task(
             description=f"""Analyze this spending data:
             
@@ -116,8 +206,6 @@ class ExpenseTasks:
             
             Return ONLY valid JSON (no markdown):
             {{
-            "total_spent": {total_spent},
-            "by_category": {json.dumps(by_category)},
             "insights": ["insight1", "insight2", "insight3"],
             "anomalies": ["any unusual spending"]
             }}
@@ -127,6 +215,7 @@ class ExpenseTasks:
         )
     
     def advise_task(self, agent, analysis):
+        from crewai import Task
         return Task(
             description=f"""Based on this analysis:
             
@@ -0,0 +1,160 @@
+import datetime as dt
+from storage import read_json, atomic_write_json
+
+AGGREGATES_FILE = "outputs/aggregates.json"
+AGGREGATES_VERSION = 2
+DEFAULT_CATEGORY = "Other"
+
+
+def expense_date(e):
+    # Receipt date when OCR found one, otherwise when it was scanned
+    for value in (e.get('date'), e.get('scanned_at')):
+        if not value:
+            continue
+        try:
+            return dt.date.fromisoformat(str(value)[:10])
+        except ValueError:
+            continue
+    return None
+
+
+def month_key(d):
+    return f"{d.year}-{d.month:02d}"
+
+
+def week_key(d):
+    year, week, _ = d.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def expense_month(e):
+    d = expense_date(e)
+    return month_key(d) if d else "unknown"
+
+
+def expense_week(e):
+    d = expense_date(e)
+    return week_key(d) if d else "unknown"
+
+
+# Spending totals per category, merchant, month, ISO week and month×category,
+# maintained incrementally.
+# Each receipt's contribution is remembered in `receipts`, so adding,
+# re-extracting or recategorizing one receipt touches only its own buckets.
+class Aggregates:
+    def __init__(self, path=AGGREGATES_FILE):
+        self.path = path
+        self.load(read_json(path, {}))
+
+    def load(self, data):
+        if data.get("version") != AGGREGATES_VERSION:
+            # Older layout; start empty so ensure() rebuilds it
+            data = {}
+        self.total_spent = data.get("total_spent", 0)
+        self.count = data.get("count", 0)
+        self.by_category = data.get("by_category", {})
+        self.by_merchant = data.get("by_merchant", {})
+        self.by_month = data.get("by_month", {})
+        self.by_week = data.get("by_week", {})
+        self.by_month_category = data.get("by_month_category", {})
+        self.receipts = data.get("receipts", {})
+
+    def _bump(self, buckets, key, amount, count):
+        bucket = buckets.setdefault(key, {"total": 0, "count": 0})
+        bucket["total"] = round(bucket["total"] + amount, 2)
+        bucket["count"] += count
+        if bucket["count"] <= 0:
+            del buckets[key]
+
+    def _apply(self, entry, sign):
+        amount = sign * entry["total"]
+        self.total_spent = round(self.total_spent + amount, 2)
+        self.count += sign
+        self._bump(self.by_category, entry["category"], amount, sign)
+        self._bump(self.by_merchant, entry["merchant"], amount, sign)
+        self._bump(self.by_month, entry["month"], amount, sign)
+        self._bump(self.by_week, entry["week"], amount, sign)
+
+        month = self.by_month_category.setdefault(entry["month"], {})
+        self._bump(month, entry["category"], amount, sign)
+        if not month:
+            del self.by_month_category[entry["month"]]
+
+    def add(self, expense, category=None):
+        img = expense['image_file']
+        old = self.receipts.get(img)
+        if category is None:
+            category = old["category"] if old else DEFAULT_CATEGORY
+
+        entry = {
+            "category": category,
+            "merchant": expense.get('merchant') or "Unknown",
+            "month": expense_month(expense),
+            "week": expense_week(expense),
+            "total": expense.get('total') or 0
+        }
+        if entry == old:
+            return False
+
+        if old:
+            self._apply(old, -1)
+        self._apply(entry, 1)
+        self.receipts[img] = entry
+        return True
+
+    def sync(self, expenses, categorization):
+        changed = 0
+        for e in expenses:
+            category = categorization.get(e['image_file'], {}).get('category', DEFAULT_CATEGORY)
+            changed += self.add(e, category)
+        return changed
+
+    def ensure(self, expenses, categorization):
+        # Cheap consistency check for readers; rebuilds only when receipts were
+        # added or removed outside the incremental path.
+        if self.count == len(expenses) and (not expenses or expenses[-1]['image_file'] in self.receipts):
+            return False
+        self.load({})
+        self.sync(expenses, categorization)
+        return True
+
+    def category_totals(self):
+        return {k: v["total"] for k, v in self.by_category.items()}
+
+    def merchant_totals(self):
+        return {k: v["total"] for k, v in self.by_merchant.items()}
+
+    def month_totals(self):
+        return {k: v["total"] for k, v in sorted(self.by_month.items())}
+
+    def week_totals(self):
+        return {k: v["total"] for k, v in sorted(self.by_week.items())}
+
+    def month_total(self, month):
+        return self.by_month.get(month, {}).get("total", 0)
+
+    def month_category_totals(self, month):
+        return {k: v["total"] for k, v in self.by_month_category.get(month, {}).items()}
+
+    def summary(self):
+        return {
+            "total_spent": self.total_spent,
+            "by_category": self.category_totals(),
+            "count": self.count
+        }
+
+    def to_dict(self):
+        return {
+            "version": AGGREGATES_VERSION,
+            "total_spent": self.total_spent,
+            "count": self.count,
+            "by_category": self.by_category,
+            "by_merchant": self.by_merchant,
+            "by_month": self.by_month,
+            "by_week": self.by_week,
+            "by_month_category": self.by_month_category,
+            "receipts": self.receipts
+        }
+
+    def save(self):
+        atomic_write_json(self.path, self.to_dict())
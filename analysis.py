@@ -1,24 +1,27 @@
-import json
+from dataset import Dataset, CREW_ANALYSIS_FILE
 
-CREW_OUTPUT = "outputs/crew_analysis.json"
+dataset = Dataset.load()
+data = dataset.crew_data
+if data is None:
+    raise SystemExit(f"{CREW_ANALYSIS_FILE} not found. Run run.py first.")
 
-with open(CREW_OUTPUT, "r") as f:
-    data = json.load(f)
-
-categorization = data["categorization"]
 analysis = data["analysis"]
 advice = data["advice"]
 
+aggregates = dataset.aggregates
+total_spent = aggregates.total_spent
+
 print("\n" + "="*70)
 print("EXPENSE REPORT WITH AI INSIGHTS")
 print("="*70)
 
-print(f"\n💰 TOTAL SPENT: ₹{analysis.get('total_spent', 0):.2f}")
+print(f"\n💰 TOTAL SPENT: ₹{total_spent:.2f}")
+print(f"🧾 RECEIPTS: {aggregates.count}")
 
 print("\n📊 BY CATEGORY:")
-for cat, amt in sorted(analysis.get('by_category', {}).items(), key=lambda x: x[1], reverse=True):
-    pct = (amt / analysis['total_spent'] * 100) if analysis['total_spent'] else 0
-    print(f"  {cat:25s}  ₹{amt:8.2f}  ({pct:5.1f}%)")
+for cat, amt in sorted(aggregates.category_totals().items(), key=lambda x: x[1], reverse=True):
+    pct = (amt / total_spent * 100) if total_spent else 0
+    print(f"  {cat:25s}  ₹{amt:8.2f}  ({pct:5.1f}%)  {dataset.index.count(cat):4d} receipts")
 
 print("\n🔍 INSIGHTS:")
 for insight in analysis.get('insights', []):
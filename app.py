@@ -1,12 +1,12 @@
 import streamlit as st
-import json
 import os
-import sys
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from pathlib import Path
 from datetime import datetime
+from storage import read_json, atomic_write_json, save_image, file_sha256, file_stamp
+from dataset import Dataset, data_version
+from aggregates import month_key
+from jobs import JobQueue, start_worker, worker_running
+from metrics import METRICS_FILE, load_events, summarize
 
 st.set_page_config(
     page_title="TrackWise - AI Expense Tracker",
@@ -15,20 +15,93 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-def load_expenses():
-    if os.path.exists("outputs/expenses.json"):
-        with open("outputs/expenses.json", "r") as f:
-            return json.load(f)
-    return []
+@st.cache_resource(max_entries=1)
+def load_dataset(version):
+    # Re-parsed only when one of the data files changes on disk
+    return Dataset.load(version)
 
-def load_crew_analysis():
-    if os.path.exists("outputs/crew_analysis.json"):
-        with open("outputs/crew_analysis.json", "r") as f:
-            return json.load(f)
-    return None
+@st.cache_data(max_entries=1)
+def load_metrics(stamp):
+    rows = []
+    for stage, s in sorted(summarize(load_events()).items()):
+        lookups = s['cache_hits'] + s['cache_misses']
+        rows.append({
+            'Stage': stage,
+            'Runs': s['count'],
+            'Avg (ms)': round(s['seconds'] / s['count'] * 1000, 1),
+            'p95 (ms)': round(s['p95'] * 1000, 1),
+            'Failures': s['failures'],
+            'Tokens': s['prompt_tokens'] + s['completion_tokens'],
+            'Cache hit rate': f"{s['cache_hits'] / lookups:.0%}" if lookups else "-"
+        })
+    return pd.DataFrame(rows)
 
-expenses = load_expenses()
-crew_data = load_crew_analysis()
+def submit_job(kind, payload, dedupe_key):
+    # Work runs in the background worker (python jobs.py), the only process
+    # that writes outputs/; the page just enqueues and polls.
+    job_id = JobQueue().enqueue(kind, payload, dedupe_key)
+    start_worker()
+    st.session_state[f"{kind}_job"] = job_id
+    return job_id
+
+def show_job(kind, messages):
+    job_id = st.session_state.get(f"{kind}_job")
+    if job_id is None:
+        return
+
+    @st.fragment(run_every=2)
+    def poll():
+        job = JobQueue().get(job_id)
+        if job is None:
+            return
+
+        if job["status"] in ("pending", "running"):
+            if job["status"] == "pending" and not worker_running():
+                start_worker()
+            st.info(f"⏳ {messages[job['status']]} (job #{job_id})")
+            return
+
+        del st.session_state[f"{kind}_job"]
+        load_dataset.clear()
+        if job["status"] == "failed":
+            st.session_state[f"{kind}_message"] = ("error", f"❌ {messages['failed']}: {job['error']}")
+        else:
+            st.session_state[f"{kind}_message"] = messages["done"](job["result"])
+        st.rerun()
+
+    poll()
+
+def show_job_message(kind):
+    message = st.session_state.pop(f"{kind}_message", None)
+    if message:
+        level, text = message
+        getattr(st, level)(text)
+
+def scan_message(result):
+    if result["status"] == "failed":
+        return ("error", "❌ OCR failed: could not extract data from this receipt")
+    if result["status"] == "duplicate":
+        return ("info", f"This receipt was already scanned as {result['image_file']}")
+    return ("success", "✅ Receipt scanned + AI analysis updated!")
+
+SCAN_MESSAGES = {
+    "pending": "Receipt queued for scanning...",
+    "running": "Scanning receipt and updating analysis...",
+    "failed": "Receipt processing failed",
+    "done": scan_message
+}
+
+ANALYZE_MESSAGES = {
+    "pending": "AI analysis queued...",
+    "running": "AI agents analyzing your spending...",
+    "failed": "Analysis failed",
+    "done": lambda result: ("success", "✅ Analysis complete!")
+}
+
+dataset = load_dataset(data_version())
+expenses = dataset.expenses
+crew_data = dataset.crew_data
+aggregates = dataset.aggregates
 
 st.title("💰 TrackWise - AI Expense Tracker")
 st.markdown("*Smart expense tracking powered by AI agents*")
@@ -56,47 +129,22 @@ if page == "🏠 Home":
             st.image(uploaded_file, caption="Uploaded Receipt", width=400)
 
             if st.button("🔍 Scan Receipt", type="primary"):
-                import subprocess, sys, time
-                os.makedirs("images", exist_ok=True)
-                save_path = os.path.join("images", uploaded_file.name)
-                with open(save_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
+                name = save_image("images", uploaded_file.name, uploaded_file.getvalue())
+                digest = file_sha256(os.path.join("images", name))
+                submit_job("scan", {"image_file": name}, f"scan:{digest}")
 
-                ocr_result = subprocess.run(
-                    [sys.executable, "extract_data.py"],
-                    capture_output=True,
-                    text=True
-                )
-
-                if ocr_result.returncode != 0:
-                    st.error("❌ OCR failed")
-                    st.code(ocr_result.stderr)
-                    st.stop()
-
-                ai_result = subprocess.run(
-                    [sys.executable, "run.py"],
-                    capture_output=True,
-                    text=True
-                )
-
-                if ai_result.returncode != 0:
-                    st.error("❌ AI Analysis failed")
-                    st.code(ai_result.stderr)
-                    st.stop()
-
-                st.success("✅ Receipt scanned + AI analysis updated!")
-                time.sleep(1)
-                st.rerun()
+        show_job("scan", SCAN_MESSAGES)
+        show_job_message("scan")
 
     
     with col2:
         st.subheader("📊 Quick Stats")
         
         if expenses:
-            total = sum(e.get('total', 0) or 0 for e in expenses)
+            total = aggregates.total_spent
             st.metric("Total Spent", f"₹{total:,.2f}")
-            st.metric("Total Receipts", len(expenses))
-            st.metric("Average Expense", f"₹{total/len(expenses):,.2f}")
+            st.metric("Total Receipts", aggregates.count)
+            st.metric("Average Expense", f"₹{total/aggregates.count:,.2f}")
         else:
             st.warning("No expenses yet")
     
@@ -118,22 +166,24 @@ if page == "🏠 Home":
             st.info("Navigate to Budget Tracker")
 
 elif page == "📊 Dashboard":
+    # plotly is only needed by the chart pages
+    import plotly.express as px
     st.header("📊 Expense Dashboard")
     
     if not expenses:
         st.warning("⚠️ No expenses found. Upload receipts to get started!")
         st.stop()
     
-    total_spent = sum(e.get('total', 0) or 0 for e in expenses)
+    total_spent = aggregates.total_spent
     
     col1, col2, col3, col4 = st.columns(4)
     col1.metric("💰 Total Spent", f"₹{total_spent:,.2f}")
-    col2.metric("🧾 Receipts", len(expenses))
-    col3.metric("📊 Average", f"₹{total_spent/len(expenses):,.2f}")
+    col2.metric("🧾 Receipts", aggregates.count)
+    col3.metric("📊 Average", f"₹{total_spent/aggregates.count:,.2f}")
     
-    valid_expenses = [e for e in expenses if e.get('total')]
-    if valid_expenses:
-        col4.metric("🔝 Highest", f"₹{max(e['total'] for e in valid_expenses):,.2f}")
+    highest = dataset.receipts_df['total'].max()
+    if pd.notna(highest) and highest:
+        col4.metric("🔝 Highest", f"₹{highest:,.2f}")
     
     st.markdown("---")
     
@@ -142,16 +192,7 @@ elif page == "📊 Dashboard":
     with col1:
         st.subheader("📈 Spending by Merchant")
         
-        merchant_totals = {}
-        for e in expenses:
-            merchant = e.get('merchant', 'Unknown')
-            total = e.get('total', 0) or 0
-            merchant_totals[merchant] = merchant_totals.get(merchant, 0) + total
-        
-        merchant_df = pd.DataFrame([
-            {'Merchant': k, 'Amount': v}
-            for k, v in sorted(merchant_totals.items(), key=lambda x: x[1], reverse=True)[:10]
-        ])
+        merchant_df = dataset.merchant_df.head(10)
         
         if not merchant_df.empty:
             fig = px.bar(
@@ -168,14 +209,9 @@ elif page == "📊 Dashboard":
         st.subheader("📊 Spending Distribution")
         
         if crew_data and 'analysis' in crew_data:
-            by_category = crew_data['analysis'].get('by_category', {})
+            cat_df = dataset.category_df
             
-            if by_category:
-                cat_df = pd.DataFrame([
-                    {'Category': k, 'Amount': v}
-                    for k, v in by_category.items()
-                ])
-                
+            if not cat_df.empty:
                 fig = px.pie(
                     cat_df,
                     values='Amount',
@@ -192,11 +228,11 @@ elif page == "📊 Dashboard":
     st.markdown("---")
     st.subheader("📋 Recent Transactions")
     
-    df = pd.DataFrame(expenses)
+    df = dataset.receipts_df
     if not df.empty:
-        display_df = df[['merchant', 'total', 'date', 'image_file']].copy()
+        display_df = df.sort_values('when', ascending=False).head(15)[['merchant', 'total', 'date', 'image_file']]
+        display_df = display_df.assign(date=display_df['date'].dt.date)
         display_df.columns = ['Merchant', 'Amount (₹)', 'Date', 'Receipt']
-        display_df = display_df.sort_values('Date', ascending=False).head(15)
         
         st.dataframe(
             display_df,
@@ -204,6 +240,11 @@ elif page == "📊 Dashboard":
             hide_index=True
         )
 
+    metrics_df = load_metrics(file_stamp(METRICS_FILE))
+    if not metrics_df.empty:
+        with st.expander("⚙️ Pipeline performance"):
+            st.dataframe(metrics_df, use_container_width=True, hide_index=True)
+
 elif page == "📋 Detailed View":
     st.header("📋 Detailed Category Analysis")
     
@@ -213,11 +254,8 @@ elif page == "📋 Detailed View":
             st.info("Navigate to AI Insights page to run analysis")
         st.stop()
     
-    analysis = crew_data.get('analysis', {})
-    categorization = crew_data.get('categorization', {})
-    
-    total_spent = analysis.get('total_spent', 0)
-    by_category = analysis.get('by_category', {})
+    total_spent = aggregates.total_spent
+    by_category = aggregates.category_totals()
     
     st.subheader(f"💰 Total Spending: ₹{total_spent:,.2f}")
     st.markdown("---")
@@ -229,16 +267,11 @@ elif page == "📋 Detailed View":
         for category, amount in sorted(by_category.items(), key=lambda x: x[1], reverse=True):
             percentage = (amount / total_spent * 100) if total_spent > 0 else 0
             
-            receipts_in_category = [
-                img for img, data in categorization.items()
-                if data.get('category') == category
-            ]
-            
             category_data.append({
                 'Category': category,
                 'Amount (₹)': f"₹{amount:,.2f}",
                 'Percentage': f"{percentage:.1f}%",
-                'Receipts': len(receipts_in_category)
+                'Receipts': dataset.index.count(category)
             })
         
         cat_summary_df = pd.DataFrame(category_data)
@@ -264,10 +297,7 @@ elif page == "📋 Detailed View":
         )
         
         if selected_category:
-            receipts_in_cat = [
-                (img, data) for img, data in categorization.items()
-                if data.get('category') == selected_category
-            ]
+            receipts_in_cat = dataset.index.receipts(selected_category)
             
             st.markdown(f"### {selected_category}")
             st.write(f"**Total:** ₹{by_category[selected_category]:,.2f}")
@@ -275,7 +305,7 @@ elif page == "📋 Detailed View":
             
             receipt_details = []
             for img, cat_data in receipts_in_cat:
-                expense = next((e for e in expenses if e['image_file'] == img), None)
+                expense = dataset.index.expense(img)
                 if expense:
                     receipt_details.append({
                         'Receipt': img,
@@ -305,15 +335,10 @@ elif page == "🤖 AI Insights":
     
     with col2:
         if st.button("🚀 Run AI Analysis", type="primary", use_container_width=True):
-            with st.spinner("AI agents analyzing your spending..."):
-                import subprocess
-                result = subprocess.run(['python', 'run.py'], capture_output=True, text=True)
-                
-                if result.returncode == 0:
-                    st.success("✅ Analysis complete!")
-                    st.rerun()
-                else:
-                    st.error("❌ Analysis failed. Check console for errors.")
+            submit_job("analyze", {}, "analyze")
+
+    show_job("analyze", ANALYZE_MESSAGES)
+    show_job_message("analyze")
     
     if not crew_data:
         st.info("👆 Click 'Run AI Analysis' to get AI-powered insights about your spending")
@@ -330,10 +355,10 @@ elif page == "🤖 AI Insights":
     
     with col1:
         st.markdown("### 💰 Financial Summary")
-        total = analysis.get('total_spent', 0)
+        total = aggregates.total_spent
         st.metric("Total Spent", f"₹{total:,.2f}")
         
-        by_category = analysis.get('by_category', {})
+        by_category = aggregates.category_totals()
         if by_category:
             st.markdown("#### Top Categories:")
             for cat, amt in sorted(by_category.items(), key=lambda x: x[1], reverse=True)[:5]:
@@ -384,14 +409,12 @@ elif page == "🤖 AI Insights":
 
 elif page == "💰 Budget Tracker":
     st.header("💰 Budget Management")
+    import plotly.express as px
     
     budget_file = "outputs/budget_settings.json"
     
-    if os.path.exists(budget_file):
-        with open(budget_file, "r") as f:
-            budget_settings = json.load(f)
-    else:
-        budget_settings = {"monthly_budget": 10000}
+    budget_settings = read_json(budget_file, {"monthly_budget": 10000})
+    category_budgets = budget_settings.get('category_budgets', {})
     
     col1, col2 = st.columns([2, 1])
     
@@ -403,22 +426,36 @@ elif page == "💰 Budget Tracker":
             min_value=0
         )
         
+        with st.expander("Per-category budgets (0 = no limit)"):
+            for category in sorted(set(aggregates.by_category) | set(category_budgets)):
+                category_budgets[category] = st.number_input(
+                    category,
+                    value=category_budgets.get(category, 0),
+                    step=100,
+                    min_value=0,
+                    key=f"budget_{category}"
+                )
+        
         if st.button("💾 Save Budget"):
             budget_settings['monthly_budget'] = monthly_budget
-            with open(budget_file, "w") as f:
-                json.dump(budget_settings, f)
+            budget_settings['category_budgets'] = {k: v for k, v in category_budgets.items() if v}
+            atomic_write_json(budget_file, budget_settings)
             st.success("Budget saved!")
     
     with col2:
         st.metric("Monthly Budget", f"₹{monthly_budget:,.2f}")
     
     if expenses:
-        total_spent = sum(e.get('total', 0) or 0 for e in expenses)
+        current_month = month_key(datetime.now())
+        months = sorted(set(aggregates.by_month) - {"unknown"} | {current_month}, reverse=True)
+        month = st.selectbox("Month", months, index=months.index(current_month))
+        
+        total_spent = aggregates.month_total(month)
         remaining = monthly_budget - total_spent
         progress = (total_spent / monthly_budget * 100) if monthly_budget > 0 else 0
         
         st.markdown("---")
-        st.subheader("📊 Budget Progress")
+        st.subheader(f"📊 Budget Progress – {month}")
         
         st.progress(min(progress / 100, 1.0))
         
@@ -438,27 +475,58 @@ elif page == "💰 Budget Tracker":
         
         st.markdown("---")
         
-        if crew_data and 'analysis' in crew_data:
-            by_category = crew_data['analysis'].get('by_category', {})
+        by_category = aggregates.month_category_totals(month)
+        
+        if by_category:
+            st.subheader("📊 Spending by Category")
             
-            if by_category:
-                st.subheader("📊 Spending by Category")
-                
-                for category, amount in sorted(by_category.items(), key=lambda x: x[1], reverse=True):
+            for category, amount in sorted(by_category.items(), key=lambda x: x[1], reverse=True):
+                limit = category_budgets.get(category, 0)
+                if limit:
+                    cat_pct = amount / limit * 100
+                    label = f"{cat_pct:.1f}% of ₹{limit:,.0f}"
+                else:
                     cat_pct = (amount / total_spent * 100) if total_spent > 0 else 0
-                    
-                    col1, col2, col3 = st.columns([2, 1, 1])
-                    col1.write(f"**{category}**")
-                    col2.write(f"₹{amount:,.2f}")
-                    col3.write(f"{cat_pct:.1f}%")
-                    
-                    st.progress(cat_pct / 100)
+                    label = f"{cat_pct:.1f}%"
+                
+                col1, col2, col3 = st.columns([2, 1, 1])
+                col1.write(f"**{category}**" + (" ⚠️" if limit and amount > limit else ""))
+                col2.write(f"₹{amount:,.2f}")
+                col3.write(label)
+                
+                st.progress(min(cat_pct / 100, 1.0))
+        
+        st.markdown("---")
+        st.subheader("📈 Spending Trend")
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            month_df = pd.DataFrame(
+                [(k, v) for k, v in aggregates.month_totals().items() if k != "unknown"][-12:],
+                columns=['Month', 'Amount']
+            )
+            if not month_df.empty:
+                fig = px.bar(month_df, x='Month', y='Amount', title='Last 12 Months')
+                if monthly_budget:
+                    fig.add_hline(y=monthly_budget, line_dash="dash", annotation_text="Budget")
+                fig.update_layout(height=350, xaxis_type='category')
+                st.plotly_chart(fig, use_container_width=True)
+        
+        with col2:
+            week_df = pd.DataFrame(
+                [(k, v) for k, v in aggregates.week_totals().items() if k != "unknown"][-12:],
+                columns=['Week', 'Amount']
+            )
+            if not week_df.empty:
+                fig = px.line(week_df, x='Week', y='Amount', markers=True, title='Last 12 Weeks')
+                fig.update_layout(height=350, xaxis_type='category')
+                st.plotly_chart(fig, use_container_width=True)
 
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 📈 Statistics")
 if expenses:
-    st.sidebar.metric("Total Expenses", len(expenses))
-    total = sum(e.get('total', 0) or 0 for e in expenses)
-    st.sidebar.metric("Total Amount", f"₹{total:,.2f}")
+    st.sidebar.metric("Total Expenses", aggregates.count)
+    st.sidebar.metric("Total Amount", f"₹{aggregates.total_spent:,.2f}")
 else:
     st.sidebar.info("No data yet")
\ No newline at end of file
@@ -0,0 +1,605 @@
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import tempfile
+import subprocess
+import argparse
+import itertools
+import threading
+import tracemalloc
+import datetime as dt
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_RECEIPT = {
+    "merchant_name": "STUB MART",
+    "date": "2024-01-15",
+    "time": "10:30",
+    "total": 42.5,
+    "subtotal": 40.0,
+    "tax": 2.5,
+    "items": [
+        {"amount": 40.0, "description": "STUB ITEM", "qty": 1}
+    ]
+}
+
+
+class StubOCRHandler(BaseHTTPRequestHandler):
+    # Stand-in for the Asprise receipt endpoint: drains the upload, sleeps for
+    # the configured latency and answers with a canned receipt. With a
+    # bandwidth (bytes/s) set, larger uploads take proportionally longer; with
+    # a rate_limit (requests/s) set, calls over it get 429 and Retry-After.
+    latency = 0.2
+    bandwidth = None
+    rate_limit = None
+    throttled = 0
+    _served = []
+    _lock = threading.Lock()
+
+    def _over_limit(self):
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            recent = [t for t in StubOCRHandler._served if now - t < 1.0]
+            over = len(recent) >= self.rate_limit
+            if over:
+                StubOCRHandler.throttled += 1
+            else:
+                recent.append(now)
+            StubOCRHandler._served = recent
+            return over
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self._over_limit():
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        time.sleep(self.latency + (length / self.bandwidth if self.bandwidth else 0))
+
+        body = json.dumps({"success": True, "receipts": [STUB_RECEIPT]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(handler, latency, bandwidth=None):
+    handler.latency = latency
+    handler.bandwidth = bandwidth
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def make_images(folder, count, source_dir="public"):
+    samples = sorted(os.listdir(source_dir))
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        src = samples[i % len(samples)]
+        ext = os.path.splitext(src)[1]
+        with open(os.path.join(source_dir, src), "rb") as f:
+            data = f.read()
+        # Trailing bytes keep every copy unique so content-hash dedup doesn't skip it
+        with open(os.path.join(folder, f"{i:06d}{ext}"), "wb") as f:
+            f.write(data + f"trackwise-bench-{i}".encode())
+
+
+def quietly(fn, *args):
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        return fn(*args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def bench_scan(args):
+    from extract_data import OCR_SCAN
+    from ocr_backends import AspriseBackend
+
+    StubOCRHandler.rate_limit = args.rate_limit
+    server, url = start_stub_server(StubOCRHandler, args.latency)
+    root = os.getcwd()
+    work = tempfile.mkdtemp(prefix="trackwise_bench_")
+    make_images(os.path.join(work, "images"), args.receipts, os.path.join(root, "public"))
+
+    limit = f", {args.rate_limit:g} req/s limit" if args.rate_limit else ""
+    print(f"Scanning {args.receipts} receipts against stub OCR ({args.latency * 1000:.0f} ms latency{limit}), "
+          f"client rate {args.rate:g} req/s\n")
+    print(f"{'workers':>8} {'seconds':>10} {'receipts/s':>12} {'saved':>7} {'429s':>6}")
+
+    try:
+        for workers in args.workers:
+            os.chdir(work)
+            shutil.rmtree("outputs", ignore_errors=True)
+            os.makedirs("outputs")
+
+            scanner = OCR_SCAN(max_workers=workers)
+            scanner.backend = AspriseBackend(url=url, pool_size=workers, rate=args.rate)
+            StubOCRHandler.throttled = 0
+
+            start = time.perf_counter()
+            quietly(scanner.process_all)
+            elapsed = time.perf_counter() - start
+
+            print(f"{workers:>8} {elapsed:>10.2f} {args.receipts / elapsed:>12.1f} "
+                  f"{len(scanner.expenses):>7} {StubOCRHandler.throttled:>6}")
+    finally:
+        os.chdir(root)
+        server.shutdown()
+        shutil.rmtree(work, ignore_errors=True)
+
+
+RECALL_FIELDS = ["merchant", "date", "time", "total", "subtotal", "tax"]
+
+
+def field_recall(original, processed):
+    # Share of the fields (and item descriptions) read from the original image
+    # that OCR still reads identically from the preprocessed one
+    expected = {f: original[f] for f in RECALL_FIELDS if original.get(f) not in (None, "")}
+    found = sum(1 for f, v in expected.items() if processed.get(f) == v)
+
+    items = {i.get('description') for i in original.get('items') or []} - {None}
+    found += len(items & {i.get('description') for i in processed.get('items') or []})
+    total = len(expected) + len(items)
+    return found / total if total else 1.0
+
+
+def bench_preprocess(args):
+    from extract_data import OCR_SCAN
+    from ratelimit import TokenBucket
+    from preprocess import preprocess_image, DEFAULT_SETTINGS, HAS_PILLOW
+
+    if not HAS_PILLOW:
+        sys.exit("The preprocess benchmark needs Pillow: pip install pillow")
+
+    root = os.getcwd()
+    source = os.path.join(root, "public")
+    samples = sorted(os.listdir(source))
+
+    print(f"Preprocessing {len(samples)} sample receipts ({DEFAULT_SETTINGS})\n")
+    print(f"{'image':>10} {'before KB':>10} {'after KB':>10} {'saved':>7} {'ms':>8}")
+    total_in = total_out = 0
+    for name in samples:
+        with open(os.path.join(source, name), "rb") as f:
+            data = f.read()
+        start = time.perf_counter()
+        processed, _ = preprocess_image(data, **DEFAULT_SETTINGS)
+        elapsed = time.perf_counter() - start
+        total_in += len(data)
+        total_out += len(processed)
+        print(f"{name:>10} {len(data) / 1024:>10.0f} {len(processed) / 1024:>10.0f} "
+              f"{1 - len(processed) / len(data):>7.0%} {elapsed * 1000:>8.1f}")
+    print(f"{'total':>10} {total_in / 1024:>10.0f} {total_out / 1024:>10.0f} {1 - total_out / total_in:>7.0%}\n")
+
+    if args.ocr_url:
+        url, server = args.ocr_url, None
+        print(f"Scanning against {url}")
+    else:
+        server, url = start_stub_server(StubOCRHandler, args.latency, args.bandwidth * 1e6 / 8)
+        print(f"Scanning against stub OCR ({args.latency * 1000:.0f} ms + upload at {args.bandwidth:g} Mbit/s)")
+
+    work = tempfile.mkdtemp(prefix="trackwise_bench_")
+    shutil.copytree(source, os.path.join(work, "images"))
+    results = {}
+    try:
+        print(f"{'mode':>14} {'seconds':>10} {'receipts/s':>12}")
+        for mode, preprocess in (("original", False), ("preprocessed", True)):
+            os.chdir(work)
+            shutil.rmtree("outputs", ignore_errors=True)
+            os.makedirs("outputs")
+
+            scanner = OCR_SCAN(max_workers=args.workers, preprocess=preprocess)
+            scanner.backend.url = url
+            if not args.ocr_url:
+                # The stub has no rate limit; measure the scanner, not the limiter
+                scanner.backend.bucket = TokenBucket(1000)
+            start = time.perf_counter()
+            quietly(scanner.process_all)
+            elapsed = time.perf_counter() - start
+            results[mode] = {e['image_file']: e for e in scanner.store.all()}
+            if scanner.preprocessor:
+                scanner.preprocessor.close()
+
+            print(f"{mode:>14} {elapsed:>10.2f} {len(samples) / elapsed:>12.1f}")
+    finally:
+        os.chdir(root)
+        if server:
+            server.shutdown()
+        shutil.rmtree(work, ignore_errors=True)
+
+    if not args.ocr_url:
+        print("\nField recall needs a real OCR endpoint: pass --ocr-url.")
+        return
+
+    recalls = [
+        field_recall(original, results["preprocessed"].get(name, {}))
+        for name, original in results["original"].items()
+    ]
+    missing = sum(1 for name in results["original"] if name not in results["preprocessed"])
+    print(f"\nField recall after preprocessing: {sum(recalls) / max(len(recalls), 1):.1%} "
+          f"over {len(recalls)} receipts ({missing} failed to scan)")
+
+
+# Synthetic data for the end-to-end suite: (merchant, category, [(item, price)])
+MERCHANTS = [
+    ("WALMART SUPERCENTER", "Groceries", [("GV WHOLE MILK", 3.48), ("BANANAS", 0.27), ("GV LARGE EGGS", 2.92), ("BREAD WHITE", 1.28), ("CHICKEN BREAST", 8.97)]),
+    ("TRADER JOE'S", "Groceries", [("BANANAS ORGANIC", 0.29), ("R-CARROTS SHREDDED 10 OZ", 1.29), ("AVOCADOS HASS BAG 4CT", 3.49), ("GREEK YOGURT", 4.99)]),
+    ("COSTCO WHOLESALE", "Groceries", [("KS WATER 40PK", 4.99), ("ROTISSERIE CHICKEN", 4.99), ("KS PAPER TOWELS", 19.99)]),
+    ("TARGET", "Household Supplies", [("UP&UP DISH SOAP", 2.69), ("TRASH BAGS 45CT", 8.49), ("LAUNDRY DETERGENT", 11.99)]),
+    ("STARBUCKS", "Food & Drinks", [("GRANDE LATTE", 4.65), ("CROISSANT", 3.25), ("COLD BREW", 4.45)]),
+    ("SUBWAY", "Food & Drinks", [("FOOTLONG TURKEY", 8.99), ("COOKIE", 0.89), ("FOUNTAIN DRINK", 2.29)]),
+    ("7-ELEVEN", "Snacks", [("DORITOS NACHO", 2.19), ("SNICKERS BAR", 1.49), ("BIG GULP", 1.39)]),
+    ("CVS PHARMACY", "Medical & Pharmacy", [("IBUPROFEN 200MG", 7.99), ("BANDAGES", 4.49), ("VITAMIN C", 9.99)]),
+    ("WALGREENS", "Toiletries & Personal Care", [("TOOTHPASTE", 3.99), ("SHAMPOO", 6.49), ("DEODORANT", 4.99)]),
+    ("BEST BUY", "Electronics", [("USB-C CABLE", 14.99), ("EARBUDS", 29.99), ("HDMI CABLE", 12.99)]),
+    ("H&M", "Clothing & Apparel", [("T-SHIRT", 9.99), ("SOCKS 3PK", 7.99), ("JEANS", 29.99)]),
+]
+
+
+def make_receipts(count, seed=0):
+    # Receipts in the extract_fields schema, spread over two years
+    rng = random.Random(seed)
+    start = dt.datetime(2024, 1, 1)
+    receipts = []
+    for i in range(count):
+        merchant, _, catalog = MERCHANTS[rng.randrange(len(MERCHANTS))]
+        items = []
+        for description, price in rng.sample(catalog, rng.randint(1, len(catalog))):
+            qty = rng.randint(1, 3)
+            items.append({
+                "amount": round(price * qty, 2), "category": None, "description": description,
+                "flags": "", "qty": qty, "remarks": None, "tags": None, "unitPrice": price
+            })
+        subtotal = round(sum(item["amount"] for item in items), 2)
+        tax = round(subtotal * 0.07, 2)
+        when = start + dt.timedelta(minutes=rng.randrange(2 * 365 * 24 * 60))
+        receipts.append({
+            "id": when.strftime("%Y%m%d_%H%M%S"),
+            "image_file": f"{i:07d}.jpg",
+            "merchant": merchant,
+            "date": when.strftime("%Y-%m-%d"),
+            "time": when.strftime("%H:%M"),
+            "total": round(subtotal + tax, 2),
+            "subtotal": subtotal,
+            "tax": tax,
+            "items": items,
+            "scanned_at": when.isoformat()
+        })
+    return receipts
+
+
+class SyntheticOCRHandler(StubOCRHandler):
+    # Answers each upload with the next synthetic receipt, in Asprise's shape
+    receipts = []
+    _next = itertools.count()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        time.sleep(self.latency)
+
+        r = self.receipts[next(self._next) % len(self.receipts)]
+        receipt = {
+            "merchant_name": r["merchant"], "date": r["date"], "time": r["time"], "total": r["total"],
+            "subtotal": r["subtotal"], "tax": r["tax"], "items": r["items"]
+        }
+        self._reply({"success": True, "receipts": [receipt]})
+
+    def _reply(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+MERCHANT_CATEGORIES = {name: category for name, category, _ in MERCHANTS}
+ITEM_CATEGORIES = {item: category for _, category, catalog in MERCHANTS for item, _ in catalog}
+
+
+class StubOllamaHandler(SyntheticOCRHandler):
+    # Stand-in for Ollama: /v1/chat/completions answers each agent task with
+    # well-formed JSON for the synthetic data; /api/embed returns hashed
+    # character-trigram vectors
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(self.latency)
+
+        if self.path.endswith("/api/embed"):
+            self._reply({"embeddings": [self._vector(text) for text in request["input"]]})
+            return
+
+        prompt = request["messages"][-1]["content"]
+        if "Categorize these receipt line items" in prompt:
+            names = [json.loads(line.strip()[2:]) for line in prompt.splitlines() if line.strip().startswith('- "')]
+            content = {"items": [{"description": n, "category": ITEM_CATEGORIES.get(n, "Other")} for n in names]}
+        elif "Categorize these receipts" in prompt:
+            entries = [line.strip()[2:].split(": ", 1) for line in prompt.splitlines() if line.strip().startswith("- ")]
+            content = {"receipts": [
+                {"image_file": img, "category": MERCHANT_CATEGORIES.get(rest.rsplit(",", 1)[0], "Other"),
+                 "confidence": 95, "reasoning": "synthetic"}
+                for img, rest in entries
+            ]}
+        elif "Analyze" in prompt:
+            content = {"insights": ["Most spending is on groceries"], "anomalies": []}
+        else:
+            content = {"budget_status": "on track", "tips": ["Cook at home"], "quick_win": "Pack lunch", "positive": "Nice!"}
+
+        text = json.dumps(content)
+        self._reply({
+            "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": request.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(text) // 4,
+                      "total_tokens": (len(prompt) + len(text)) // 4}
+        })
+
+    def _vector(self, text):
+        vector = [0.0] * 64
+        padded = f"  {text} "
+        for i in range(len(padded) - 2):
+            vector[zlib.crc32(padded[i:i + 3].encode()) % 64] += 1
+        return vector
+
+
+def timed(fn, latencies):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+
+def run_stage(name, setup, body, memory):
+    # body(state) does the work and returns (items processed, per-op latencies).
+    # Timed without tracemalloc; peak memory comes from a second, traced run.
+    state = setup()
+    start = time.perf_counter()
+    count, latencies = body(state)
+    elapsed = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        state = setup()
+        tracemalloc.start()
+        body(state)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000 if latencies else (float("nan"),) * 3
+    return {
+        "stage": name, "items": count, "seconds": elapsed, "per_second": count / elapsed if elapsed else 0,
+        "p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "peak_mb": peak / 1e6 if peak is not None else None
+    }
+
+
+def bench_suite(args):
+    ocr_server, ocr_url = start_stub_server(SyntheticOCRHandler, args.ocr_latency)
+    llm_server, llm_url = start_stub_server(StubOllamaHandler, args.llm_latency)
+    os.environ["OLLAMA_URL"] = llm_url
+    os.environ["OLLAMA_EMBED_MODEL"] = "stub-embed"
+
+    from extract_data import OCR_SCAN
+    from ocr_backends import AspriseBackend
+    from aggregates import Aggregates
+    from dataset import Dataset
+    import run
+
+    print(f"Generating {args.receipts:,} synthetic receipts...")
+    receipts = make_receipts(args.receipts, args.seed)
+    SyntheticOCRHandler.receipts = receipts
+    categorization = {
+        r["image_file"]: {"category": MERCHANT_CATEGORIES[r["merchant"]], "confidence": 95, "reasoning": "synthetic"}
+        for r in receipts
+    }
+
+    root = os.getcwd()
+    work = tempfile.mkdtemp(prefix="trackwise_bench_")
+
+    def fresh_dir(name):
+        path = os.path.join(work, f"{name}_{time.perf_counter_ns()}")
+        os.makedirs(os.path.join(path, "outputs"))
+        os.chdir(path)
+        return path
+
+    def scan_setup():
+        fresh_dir("scan")
+        os.makedirs("images")
+        for r in receipts[:args.scan_receipts]:
+            with open(os.path.join("images", r["image_file"]), "wb") as f:
+                f.write(r["image_file"].encode())
+        scanner = OCR_SCAN(max_workers=args.workers)
+        scanner.backend = AspriseBackend(url=ocr_url, pool_size=args.workers, rate=args.rate)
+        return scanner
+
+    def scan_body(scanner):
+        latencies = []
+        scanner.backend.recognize = timed(scanner.backend.recognize, latencies)
+        quietly(scanner.process_all)
+        return len(scanner.expenses), latencies
+
+    def categorize_setup():
+        fresh_dir("categorize")
+        return receipts[:args.llm_receipts]
+
+    def categorize_body(sample):
+        latencies = []
+        original = run.run_task
+        run.run_task = timed(original, latencies)
+        try:
+            result = quietly(run.categorize_new_expenses, sample, sample, {})
+        finally:
+            run.run_task = original
+        return len(result), latencies
+
+    def aggregate_setup():
+        fresh_dir("aggregate")
+        return Aggregates(os.path.join("outputs", "aggregates.json"))
+
+    def aggregate_body(aggregates):
+        latencies = []
+        add = timed(aggregates.add, latencies)
+        for r in receipts:
+            add(r, categorization[r["image_file"]]["category"])
+        return aggregates.count, latencies
+
+    aggregates = Aggregates(os.path.join(work, "aggregates.json"))
+    aggregates.sync(receipts, categorization)
+    crew_data = {"categorization": categorization}
+
+    def dashboard_body(_):
+        start = time.perf_counter()
+        dataset = Dataset(receipts, crew_data, aggregates)
+        dataset.receipts_df.sort_values("when", ascending=False).head(15)
+        dataset.index.receipts("Groceries")
+        return len(dataset.receipts_df), [time.perf_counter() - start]
+
+    stages = [
+        (f"scan ({args.workers} workers)", scan_setup, scan_body),
+        ("categorize", categorize_setup, categorize_body),
+        ("aggregate", aggregate_setup, aggregate_body),
+        ("dashboard prep", lambda: None, dashboard_body),
+    ]
+
+    print(f"Stub OCR latency {args.ocr_latency * 1000:.0f} ms, stub LLM latency {args.llm_latency * 1000:.0f} ms\n")
+    print(f"{'stage':<22} {'items':>9} {'seconds':>9} {'items/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak MB':>9}")
+    results = []
+    try:
+        for name, setup, body in stages:
+            if args.only and not any(name.startswith(s) for s in args.only):
+                continue
+            row = run_stage(name, setup, body, args.memory)
+            results.append(row)
+            peak = f"{row['peak_mb']:>9.1f}" if row["peak_mb"] is not None else f"{'-':>9}"
+            print(f"{row['stage']:<22} {row['items']:>9,} {row['seconds']:>9.2f} {row['per_second']:>10,.0f} "
+                  f"{row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f} {peak}")
+    finally:
+        os.chdir(root)
+        ocr_server.shutdown()
+        llm_server.shutdown()
+        shutil.rmtree(work, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"receipts": args.receipts, "stages": results}, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+# (label, code, modules it must not pull in). Each runs in a fresh interpreter
+# from a scratch directory holding one already-analyzed receipt.
+IMPORT_CHECKS = [
+    ("import run", "import run", ["crewai"]),
+    ("import pipeline", "import pipeline", ["crewai"]),
+    ("import extract_data", "import extract_data", ["crewai", "pandas"]),
+    ("run.py, nothing new", "import run; run.run_expense_crew()", ["crewai"]),
+]
+
+IMPORT_PROBE = """import sys, time, json
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+{code}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+
+def bench_imports(args):
+    root = os.path.dirname(os.path.abspath(__file__))
+    work = tempfile.mkdtemp(prefix="trackwise_bench_")
+    # One uncategorized line item, so the no-new path reaches the item stage
+    receipt = {"image_file": "r1.jpg", "merchant": "STUB MART", "date": "2024-01-15", "total": 42.5,
+               "items": [{"description": "BANANAS ORGANIC", "amount": 42.5, "qty": 1}]}
+    os.makedirs(os.path.join(work, "outputs"))
+    with open(os.path.join(work, "outputs", "expenses.json"), "w") as f:
+        json.dump([receipt], f)
+    with open(os.path.join(work, "outputs", "crew_analysis.json"), "w") as f:
+        json.dump({"categorization": {"r1.jpg": {"category": "Groceries"}}, "analysis": {}, "advice": {}}, f)
+
+    print(f"Budget {args.budget:.2f} s, best of {args.repeat}\n")
+    print(f"{'check':<24} {'seconds':>9}  result")
+    failed = False
+    try:
+        for label, code, forbidden in IMPORT_CHECKS:
+            best, loaded = None, []
+            for _ in range(args.repeat):
+                out = subprocess.run(
+                    [sys.executable, "-c", IMPORT_PROBE.format(root=root, code=code, forbidden=forbidden)],
+                    cwd=work, capture_output=True, text=True, env={**os.environ, "TRACKWISE_METRICS": "0"}
+                )
+                if out.returncode != 0:
+                    raise SystemExit(f"{label} failed:\n{out.stderr}")
+                probe = json.loads(out.stdout.strip().splitlines()[-1])
+                best = probe["seconds"] if best is None else min(best, probe["seconds"])
+                loaded = probe["loaded"]
+
+            problems = []
+            if best > args.budget:
+                problems.append("over budget")
+            if loaded:
+                problems.append(f"imported {', '.join(loaded)}")
+            failed = failed or bool(problems)
+            print(f"{label:<24} {best:>9.3f}  {'; '.join(problems) or 'ok'}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TrackWise benchmarks")
+    sub = parser.add_subparsers(dest="stage", required=True)
+
+    scan = sub.add_parser("scan", help="OCR scanning throughput against a stub server")
+    scan.add_argument("--receipts", type=int, default=50)
+    scan.add_argument("--latency", type=float, default=0.2, help="stub OCR latency in seconds")
+    scan.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    scan.add_argument("--rate", type=float, default=1000, help="client request rate cap (OCR_RATE) in requests/s")
+    scan.add_argument("--rate-limit", type=float, help="stub answers 429 above this many requests/s")
+    scan.set_defaults(func=bench_scan)
+
+    pre = sub.add_parser("preprocess", help="image preprocessing: bytes saved, scan latency and OCR field recall")
+    pre.add_argument("--ocr-url", help="real OCR endpoint, needed to measure field recall")
+    pre.add_argument("--latency", type=float, default=0.2, help="stub OCR latency in seconds")
+    pre.add_argument("--bandwidth", type=float, default=20, help="stub upload bandwidth in Mbit/s")
+    pre.add_argument("--workers", type=int, default=4)
+    pre.set_defaults(func=bench_preprocess)
+
+    suite = sub.add_parser("suite", help="end-to-end: synthetic receipts through stub OCR and Ollama servers")
+    suite.add_argument("--receipts", type=int, default=10_000, help="synthetic receipts for aggregation and dashboard prep")
+    suite.add_argument("--scan-receipts", type=int, default=500, help="receipts pushed through the scanner")
+    suite.add_argument("--llm-receipts", type=int, default=200, help="receipts pushed through the categorizer")
+    suite.add_argument("--ocr-latency", type=float, default=0.05, help="stub OCR latency in seconds")
+    suite.add_argument("--llm-latency", type=float, default=0.2, help="stub LLM latency in seconds")
+    suite.add_argument("--workers", type=int, default=8, help="scanner workers")
+    suite.add_argument("--rate", type=float, default=1000, help="client request rate cap (OCR_RATE) in requests/s")
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--only", nargs="+", help="run only these stages (scan, categorize, aggregate, dashboard)")
+    suite.add_argument("--no-memory", dest="memory", action="store_false", help="skip the traced run for peak memory")
+    suite.add_argument("--json", help="also write the results to this file")
+    suite.set_defaults(func=bench_suite)
+
+    imports = sub.add_parser("imports", help="startup cost: import time and heavy modules pulled in; exits 1 on a regression")
+    imports.add_argument("--budget", type=float, default=1.5, help="seconds allowed per check")
+    imports.add_argument("--repeat", type=int, default=3)
+    imports.set_defaults(func=bench_imports)
+
+    args = parser.parse_args()
+    args.func(args)
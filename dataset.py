@@ -0,0 +1,78 @@
+import os
+import pandas as pd
+from storage import ExpenseStore, read_json, file_stamp, EXPENSES_FILE
+from aggregates import Aggregates, AGGREGATES_FILE
+from tables import build_tables, load_tables, save_tables, tables_current, HAS_PARQUET
+
+CREW_ANALYSIS_FILE = "outputs/crew_analysis.json"
+
+
+def data_version():
+    # Changes whenever the worker (or a script) rewrites any of the inputs
+    log_path = os.path.splitext(EXPENSES_FILE)[0] + ".jsonl"
+    return file_stamp(EXPENSES_FILE, log_path, CREW_ANALYSIS_FILE, AGGREGATES_FILE)
+
+
+# image_file -> expense and category -> [(image_file, categorization entry)],
+# built in one pass so per-receipt and per-category lookups are O(1).
+class ReceiptIndex:
+    def __init__(self, expenses, categorization):
+        self.by_image = {e['image_file']: e for e in expenses}
+        self.by_category = {}
+        for img, data in categorization.items():
+            self.by_category.setdefault(data.get('category'), []).append((img, data))
+
+    def expense(self, image_file):
+        return self.by_image.get(image_file)
+
+    def receipts(self, category):
+        return self.by_category.get(category, [])
+
+    def count(self, category):
+        return len(self.by_category.get(category, ()))
+
+
+# Everything the web app pages read, parsed and shaped once per data version.
+# Shared between reruns and sessions, so treat the contents as read-only.
+class Dataset:
+    def __init__(self, expenses, crew_data, aggregates, tables=None):
+        self.expenses = expenses
+        self.crew_data = crew_data
+        self.categorization = crew_data.get('categorization', {}) if crew_data else {}
+        self.aggregates = aggregates
+        self.index = ReceiptIndex(expenses, self.categorization)
+
+        self.receipts_df, self.items_df = tables or build_tables(expenses, self.categorization)
+        self.merchant_df = pd.DataFrame(
+            sorted(aggregates.merchant_totals().items(), key=lambda x: x[1], reverse=True),
+            columns=['Merchant', 'Amount']
+        )
+        self.category_df = pd.DataFrame(
+            sorted(aggregates.category_totals().items(), key=lambda x: x[1], reverse=True),
+            columns=['Category', 'Amount']
+        )
+
+    @classmethod
+    def load(cls, version=None):
+        version = version or data_version()
+        expenses = ExpenseStore(EXPENSES_FILE).all()
+        crew_data = read_json(CREW_ANALYSIS_FILE)
+
+        aggregates = Aggregates()
+        aggregates.ensure(expenses, crew_data.get('categorization', {}) if crew_data else {})
+
+        # Flattened tables are reused from Parquet until the data changes;
+        # only writers export them (export_tables), readers build in memory
+        return cls(expenses, crew_data, aggregates, load_tables(version))
+
+
+def export_tables():
+    # Called by whoever just wrote the data (worker, run.py, extract_data.py)
+    # while holding the worker lock, so readers never write outputs/
+    if not HAS_PARQUET:
+        return False
+    version = data_version()
+    if tables_current(version):
+        return False
+    dataset = Dataset.load(version)
+    return save_tables(dataset.receipts_df, dataset.items_df, version)
@@ -0,0 +1,85 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from storage import atomic_write_json
+
+
+# JSON values on disk, one file per key. Entries are kept in LRU order (file
+# mtime is bumped on every hit, so the order survives restarts) and the oldest
+# are evicted once the folder grows past max_bytes.
+class DiskCache:
+    def __init__(self, folder, max_bytes=200 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        os.makedirs(folder, exist_ok=True)
+        files = []
+        for entry in os.scandir(folder):
+            if entry.name.endswith(".json") and not entry.name.startswith("."):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._bytes += size
+
+    def make_key(self, *parts):
+        raw = json.dumps(parts, sort_keys=True)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + ".json")
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key), "r") as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self._bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            os.utime(self._path(key))
+            self.hits += 1
+            return data
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)
+                if os.path.exists(self._path(key)):
+                    os.remove(self._path(key))
+
+    def put(self, key, data):
+        with self._lock:
+            path = self._path(key)
+            atomic_write_json(path, data, indent=None)
+            size = os.path.getsize(path)
+
+            self._bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                if os.path.exists(self._path(old_key)):
+                    os.remove(self._path(old_key))
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "bytes": self._bytes
+        }
@@ -0,0 +1,121 @@
+import os
+import numpy as np
+import requests
+from storage import read_json, atomic_write_json
+
+EMBED_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434") + "/api/embed"
+EMBED_MODEL = os.environ.get("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+EMBEDDINGS_DIR = "outputs/embeddings"
+EMBED_BATCH_SIZE = 64
+
+# Nearest neighbours must be at least this similar (cosine) to decide alone
+MIN_SIMILARITY = float(os.environ.get("EMBED_MIN_SIMILARITY", 0.85))
+NEIGHBOURS = 5
+
+# Sources that came from the index itself; never fed back into it
+DERIVED_SOURCES = {"embedding"}
+
+
+def embed(texts, model=EMBED_MODEL, timeout=60):
+    # Unit-length float32 rows from the local Ollama embedding endpoint
+    vectors = []
+    for i in range(0, len(texts), EMBED_BATCH_SIZE):
+        response = requests.post(
+            EMBED_URL,
+            json={"model": model, "input": texts[i:i + EMBED_BATCH_SIZE]},
+            timeout=timeout
+        )
+        response.raise_for_status()
+        vectors.extend(response.json()["embeddings"])
+
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+# Embeddings of already-categorized keys (normalized merchant names or item
+# descriptions) as one NumPy matrix, with a category label per row. New keys
+# are categorized by a similarity-weighted vote of their nearest neighbours.
+class EmbeddingIndex:
+    def __init__(self, name, folder=EMBEDDINGS_DIR, model=EMBED_MODEL):
+        self.model = model
+        self.matrix_path = os.path.join(folder, f"{name}.npy")
+        self.meta_path = os.path.join(folder, f"{name}.json")
+
+        meta = read_json(self.meta_path, {})
+        self.keys, self.labels = [], []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        if meta.get("model") == model and os.path.exists(self.matrix_path):
+            self.keys, self.labels = meta["keys"], meta["labels"]
+            self.matrix = np.load(self.matrix_path)
+        self._rows = {key: i for i, key in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def sync(self, rules):
+        # rules: key -> {"category", "source"}. Embeds only keys not seen
+        # before; relabels the rest in place. Returns False if Ollama is down.
+        rules = {k: r for k, r in rules.items() if r.get('source') not in DERIVED_SOURCES}
+        changed = False
+        for key, rule in rules.items():
+            row = self._rows.get(key)
+            if row is not None and self.labels[row] != rule['category']:
+                self.labels[row] = rule['category']
+                changed = True
+
+        new_keys = [key for key in rules if key not in self._rows]
+        if new_keys:
+            try:
+                vectors = embed(new_keys, self.model)
+            except (requests.RequestException, KeyError, ValueError) as e:
+                print(f"Embedding endpoint unavailable ({type(e).__name__}); skipping nearest-neighbour matching.")
+                return False
+            self.matrix = vectors if not len(self.keys) else np.vstack([self.matrix, vectors])
+            for key in new_keys:
+                self._rows[key] = len(self.keys)
+                self.keys.append(key)
+                self.labels.append(rules[key]['category'])
+            changed = True
+
+        if changed:
+            self.save()
+        return True
+
+    def query(self, keys, k=NEIGHBOURS, min_similarity=MIN_SIMILARITY):
+        # {key: (category, similarity)} for keys whose neighbours agree closely
+        # enough; everything else is left for the LLM
+        if not keys or not len(self.keys):
+            return {}
+        try:
+            vectors = embed(keys, self.model)
+        except (requests.RequestException, KeyError, ValueError) as e:
+            print(f"Embedding endpoint unavailable ({type(e).__name__}); skipping nearest-neighbour matching.")
+            return {}
+
+        similarity = vectors @ self.matrix.T
+        k = min(k, len(self.keys))
+        top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+
+        labels = np.asarray(self.labels, dtype=object)
+        matches = {}
+        for key, row, neighbours in zip(keys, similarity, top):
+            votes = {}
+            for i in neighbours:
+                if row[i] > 0:
+                    votes[labels[i]] = votes.get(labels[i], 0) + row[i]
+            if not votes:
+                continue
+
+            category = max(votes, key=votes.get)
+            best = max(row[i] for i in neighbours if labels[i] == category)
+            if best >= min_similarity:
+                matches[key] = (category, float(best))
+        return matches
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.matrix_path), exist_ok=True)
+        tmp = self.matrix_path + ".tmp.npy"
+        np.save(tmp, self.matrix)
+        os.replace(tmp, self.matrix_path)
+        atomic_write_json(self.meta_path, {"model": self.model, "keys": self.keys, "labels": self.labels}, indent=None)
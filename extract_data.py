@@ -1,38 +1,97 @@
 import os
-import json
+import hashlib
+import argparse
 import requests
+import subprocess
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from storage import ExpenseStore, ProcessedIndex, read_json, file_sha256
+from ocr_cache import OCRCache
+from aggregates import Aggregates
+from preprocess import Preprocessor, HAS_PILLOW
+from ocr_backends import make_backend, OCR_BACKEND, BACKENDS
+from metrics import timed, write_prometheus
+
+# Shrink images (rotate, grayscale, downscale, re-encode) before uploading
+PREPROCESS = os.environ.get("OCR_PREPROCESS", "0") == "1"
 
 class OCR_SCAN():
-    def __init__(self):
+    def __init__(self, max_workers=4, timeout=60, preprocess=PREPROCESS, backend=OCR_BACKEND):
         self.API_KEY="TEST" 
-        self.url="https://ocr2.asprise.com/api/v1/receipt"
         self.IMAGES_DIR="images"
         self.OUTPUT_DIR="outputs/expenses.json"
-        
-        if os.path.exists(self.OUTPUT_DIR):
-            with open(self.OUTPUT_DIR,"r") as f:
-                self.expenses=json.load(f)
-        else :
-            self.expenses=[]
+        self.TIMEOUT=timeout
+        self.RECOGNIZER="auto"
+
+        self.backend=make_backend(backend, api_key=self.API_KEY, recognizer=self.RECOGNIZER, timeout=timeout, pool_size=max_workers)
+        # Local engines run one OCR process per core
+        self.MAX_WORKERS=max(max_workers, self.backend.workers or 0)
+
+        self.store=ExpenseStore(self.OUTPUT_DIR)
+        self.expenses=self.store.all()
+        self.index=ProcessedIndex(os.path.join(os.path.dirname(self.OUTPUT_DIR), "processed_index.jsonl"))
+        self.index.sync(self.expenses, self.IMAGES_DIR)
+        self.cache=OCRCache(os.path.join(os.path.dirname(self.OUTPUT_DIR), "ocr_cache"))
+        self.aggregates=self.load_aggregates()
+
+        self.preprocessor=None
+        if preprocess and HAS_PILLOW:
+            self.preprocessor=Preprocessor()
+        elif preprocess:
+            print("Pillow is not installed (pip install pillow); uploading original images.")
     
-    def scan_image(self,path):
+    def refresh(self):
+        # Long-lived scanners (the web app) pick up receipts added by other runs
+        if not self.store.changed_on_disk():
+            return
+        self.expenses=self.store.load()
+        self.index.load()
+        self.index.sync(self.expenses, self.IMAGES_DIR)
+        self.aggregates=self.load_aggregates()
+    
+    def load_aggregates(self):
+        # aggregates.json is a derived file; rebuild it when it is missing or
+        # out of step with the store, using the stored categorization
+        outputs=os.path.dirname(self.OUTPUT_DIR)
+        aggregates=Aggregates(os.path.join(outputs, "aggregates.json"))
+        crew_data=read_json(os.path.join(outputs, "crew_analysis.json")) or {}
+        if aggregates.ensure(self.expenses, crew_data.get("categorization", {})):
+            aggregates.save()
+        return aggregates
+    
+    def cache_key(self,digest):
+        settings=self.backend.settings()
+        if self.preprocessor:
+            settings["preprocess"]=self.preprocessor.settings
+        return self.cache.key(digest, settings)
+
+    def scan_image(self,path,digest=None):
         with open(path,"rb") as f:
-            response = requests.post(
-                self.url, 
-                data = {
-                    'api_key': self.API_KEY,        
-                    'recognizer': 'auto',     
-                    'ref_no': 'ocr_python_123'
-                },
-                files = {"file": f}
-            )
-        
-        if(response.status_code!=200) :
-            return None
-        
-        data=response.json()
-        return data
+            image_bytes=f.read()
+
+        key=self.cache_key(digest or hashlib.sha256(image_bytes).hexdigest())
+        with timed("ocr.scan", backend=self.backend.name) as event:
+            cached=self.cache.get(key)
+            event["cache"]="hit" if cached is not None else "miss"
+            if cached is not None:
+                return cached
+
+            name=os.path.basename(path)
+            if self.preprocessor:
+                with timed("ocr.preprocess"):
+                    image_bytes, changed=self.preprocessor.run(image_bytes)
+                if changed:
+                    name=os.path.splitext(name)[0]+".jpg"
+
+            event["bytes"]=len(image_bytes)
+            data=self.backend.recognize(image_bytes, name)
+            if data is None:
+                event["ok"]=False
+                return None
+
+            if data.get("receipts"):
+                self.cache.put(key, data)
+            return data
 
 
     def extract_fields(self,data,path):     
@@ -52,45 +111,131 @@ class OCR_SCAN():
         }
     
     
+    def _scan_file(self, pending):
+        file, digest = pending
+        print(f"Scanning → {file}")
+        full_path = os.path.join(self.IMAGES_DIR, file)
+        try:
+            return self.scan_image(full_path, digest)
+        except (requests.RequestException, subprocess.SubprocessError) as e:
+            print(f"OCR failed for {file}: {e}")
+            return None
+
+
+    def process_file(self, file):
+        # Scan a single image already saved in IMAGES_DIR, without listing the
+        # folder. Aggregates are updated in memory; the caller saves them.
+        if self.index.has_file(file):
+            return "duplicate", self.store.get(file)
+
+        digest = file_sha256(os.path.join(self.IMAGES_DIR, file))
+        original = self.index.lookup(digest)
+        if original:
+            print(f"Skipping {file} (duplicate of {original}).")
+            return "duplicate", self.store.get(original)
+
+        structured = self._save_result(file, digest, self._scan_file((file, digest)))
+        if not structured:
+            return "failed", None
+
+        return "saved", structured
+
+
     def process_all(self):
-        files = [
-            f for f in os.listdir(self.IMAGES_DIR)
-        ]
+        files = sorted(os.listdir(self.IMAGES_DIR))
 
         print(f"Found {len(files)} receipts in folder.")
 
+        pending = []
+        digests = {}
         for file in files:
-            if any(r["image_file"] == file for r in self.expenses):
+            if self.index.has_file(file):
                 print(f"Skipping {file} (already processed).")
                 continue
 
-            print(f"Scanning → {file}")
-            full_path = os.path.join(self.IMAGES_DIR, file)
+            digest = file_sha256(os.path.join(self.IMAGES_DIR, file))
+            original = self.index.lookup(digest) or digests.get(digest)
+            if original:
+                print(f"Skipping {file} (duplicate of {original}).")
+                continue
 
-            result = self.scan_image(full_path)
+            digests[digest] = file
+            pending.append((file, digest))
 
-            if not result or "receipts" not in result or len(result["receipts"]) == 0:
-                print(f"Could NOT extract data from: {file}")
-                continue
+        print(f"Scanning {len(pending)} receipts with {self.MAX_WORKERS} workers...")
 
-            structured  = self.extract_fields(result, file)
-            self.expenses.append(structured)
+        # map() yields results in submission order, so receipts are saved in
+        # folder order no matter which upload finishes first.
+        with timed("ocr.batch", records=len(pending)), ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as pool:
+            results = pool.map(self._scan_file, pending)
 
-            with open(self.OUTPUT_DIR, "w") as f:
-                json.dump(self.expenses, f, indent=2)
+            failed = 0
+            for (file, digest), result in zip(pending, results):
+                failed += self._save_result(file, digest, result) is None
 
-            print(f"Saved: {structured['merchant']} - {structured['total']}")
+        self.store.compact()
+        self.aggregates.save()
+        write_prometheus()
 
         print("\n----- Processing complete -----")
         print(f"Total receipts processed: {len(self.expenses)}")
+        if failed:
+            print(f"{failed} receipts could not be scanned; they are retried on the next run.")
+        stats = self.cache.stats()
+        print(f"OCR cache: {stats['hits']} hits, {stats['misses']} misses")
+        if self.preprocessor:
+            stats = self.preprocessor.stats()
+            print(f"Preprocessing: {stats['bytes_in'] / 1e6:.1f} MB → {stats['bytes_out'] / 1e6:.1f} MB "
+                  f"({stats['ratio']:.0%} saved)")
+
+
+    def replay_from_cache(self):
+        # Re-run extract_fields over cached raw OCR, e.g. after the schema changes
+        replayed = 0
+        for e in self.store.all():
+            if not e.get("sha256"):
+                continue
+            data = self.cache.get(self.cache_key(e["sha256"]))
+            if not data:
+                continue
+
+            structured = self.extract_fields(data, e["image_file"])
+            structured["id"] = e["id"]
+            structured["scanned_at"] = e["scanned_at"]
+            structured["sha256"] = e["sha256"]
+            self.store.append(structured)
+            self.aggregates.add(structured)
+            replayed += 1
+
+        self.store.compact()
+        self.aggregates.save()
+        self.expenses = self.store.all()
+
+        stats = self.cache.stats()
+        print(f"Replayed {replayed} receipts from cache ({stats['misses']} not cached).")
+
+
+    def _save_result(self, file, digest, result):
+        if not result or "receipts" not in result or len(result["receipts"]) == 0:
+            print(f"Could NOT extract data from: {file}")
+            return None
+
+        structured  = self.extract_fields(result, file)
+        structured["sha256"] = digest
+        self.store.append(structured)
+        self.index.add(file, digest)
+        self.aggregates.add(structured)
+        self.expenses.append(structured)
+
+        print(f"Saved: {structured['merchant']} - {structured['total']}")
+        return structured
 
     
     def show_summary(self):
         print("\n===== SUMMARY =====\n")
         print(f"Total receipts: {len(self.expenses)}")
 
-        total_spent = sum(e.get("total", 0) for e in self.expenses if e.get("total"))
-        print(f"Total spent: ₹{total_spent:.2f}\n")
+        print(f"Total spent: ₹{self.aggregates.total_spent:.2f}\n")
 
         print("Last few receipts:\n")
         for e in self.expenses[-5:]:
@@ -98,6 +243,41 @@ class OCR_SCAN():
 
 
 if __name__=="__main__":
-    scanner=OCR_SCAN()
-    scanner.process_all()
-    scanner.show_summary()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Scan receipt images into outputs/expenses.json")
+    parser.add_argument("--replay", action="store_true", help="re-extract stored receipts from the OCR cache without network calls")
+    parser.add_argument("--preprocess", action="store_true", default=PREPROCESS, help="shrink images before uploading (needs Pillow)")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=OCR_BACKEND, help="OCR engine (default: $OCR_BACKEND or asprise)")
+    parser.add_argument("--watch", action="store_true", help="keep running and scan, categorize and aggregate each new image as it lands in images/")
+    args = parser.parse_args()
+
+    options = {
+        "max_workers": int(os.environ.get("OCR_WORKERS", 4)),
+        "timeout": float(os.environ.get("OCR_TIMEOUT", 60)),
+        "preprocess": args.preprocess,
+        "backend": args.backend
+    }
+
+    if args.watch:
+        # The background worker owns outputs/, so watching runs inside it
+        from jobs import run_worker
+        try:
+            run_worker(watch=True, scanner_options=options)
+        except RuntimeError as e:
+            raise SystemExit(str(e))
+        except KeyboardInterrupt:
+            print("Stopped.")
+        raise SystemExit
+
+    from jobs import writer_lock
+    from dataset import export_tables
+    lock=writer_lock()
+    try:
+        scanner=OCR_SCAN(**options)
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+    if args.replay:
+        scanner.replay_from_cache()
+    else:
+        scanner.process_all()
+    scanner.show_summary()
+    export_tables()
\ No newline at end of file
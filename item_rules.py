@@ -0,0 +1,132 @@
+import sys
+import pandas as pd
+from storage import read_json, atomic_write_json
+
+ITEM_RULES_FILE = "outputs/item_rules.json"
+CATEGORIZED_FILE = "outputs/categorized.json"
+
+# Weight/size/count units left over once digits are stripped ("10 OZ", "80GR")
+UNITS = r"oz|lb|lbs|g|gr|kg|ml|l|ct|pk|pkg|ea|each"
+
+# Labels in categorized.json that say nothing about the item
+VAGUE = {"uncategorized", "miscellaneous", "unknown grocery item", "unknown/invalid item"}
+
+
+def normalize_descriptions(descriptions):
+    # Vectorized: "R-CARROTS SHREDDED 10 OZ" -> "carrots shredded",
+    # "MILKY BAR CHOC80GR" -> "milky bar choc", UPC codes and flags dropped
+    text = descriptions.astype("string").fillna("").str.lower()
+    text = text.str.replace(r"[^a-z&]+", " ", regex=True)
+    text = text.str.replace(rf"\b(?:{UNITS}|[a-z])\b", " ", regex=True)
+    return text.str.split().str.join(" ").fillna("")
+
+
+# Normalized item description -> category, bootstrapped from
+# outputs/categorized.json and extended with every LLM answer, so each distinct
+# item is only ever sent to the LLM once.
+class ItemRules:
+    def __init__(self, path=ITEM_RULES_FILE):
+        self.path = path
+        data = read_json(path, {})
+        self.rules = data.get("rules", {})
+        self.stats = data.get("stats", {"rule_hits": 0, "sent_to_llm": 0})
+        # Keys the LLM was asked about but left unresolved (failed batch or a
+        # vague label); not sent again until `python item_rules.py retry`
+        self.attempted = set(data.get("attempted", []))
+        self._spellings = {rule['category'].lower(): rule['category'] for rule in self.rules.values()}
+        if not self.rules:
+            self.bootstrap(read_json(CATEGORIZED_FILE, {}))
+
+    def bootstrap(self, categorized):
+        pairs = [
+            (item.get('description'), item.get('category'))
+            for receipt in categorized.values()
+            for item in receipt.get('item_categories', [])
+        ]
+        return self.learn(pairs, source="categorized.json")
+
+    def canonical(self, category):
+        # Reuse the spelling already in the dictionary ("Household supplies"
+        # and "Household Supplies" are one category)
+        category = " ".join(str(category).split())
+        return self._spellings.setdefault(category.lower(), category)
+
+    def learn(self, pairs, source="llm"):
+        if not pairs:
+            return 0
+        descriptions, categories = zip(*pairs)
+        keys = normalize_descriptions(pd.Series(descriptions, dtype="object"))
+
+        learned = 0
+        for key, category in zip(keys, categories):
+            if not key or not category or str(category).strip().lower() in VAGUE:
+                continue
+            current = self.rules.get(key)
+            if current and current['source'] == 'user':
+                continue
+            self.rules[key] = {"category": self.canonical(category), "source": source}
+            self.attempted.discard(key)
+            learned += 1
+        return learned
+
+    def set_override(self, description, category):
+        key = normalize_descriptions(pd.Series([description])).iloc[0]
+        if not key:
+            raise ValueError(f"Cannot build a rule for item {description!r}")
+        self.rules[key] = {"category": self.canonical(category), "source": "user"}
+        self.attempted.discard(key)
+        return key
+
+    def categories(self):
+        return {key: rule['category'] for key, rule in self.rules.items()}
+
+    def known_categories(self):
+        return sorted({rule['category'] for rule in self.rules.values()})
+
+    def save(self):
+        atomic_write_json(self.path, {"rules": self.rules, "stats": self.stats, "attempted": sorted(self.attempted)})
+
+
+def export_categorized(categorized, categorization, path=CATEGORIZED_FILE):
+    # Merge {image_file: [(line, description, category)]} into the existing
+    # file; receipts and items not listed keep whatever they already had
+    data = read_json(path, {})
+    for img, items in categorized.items():
+        entry = data.setdefault(img, {"receipt_category": None, "item_categories": []})
+        entry["receipt_category"] = categorization.get(img, {}).get('category') or entry.get("receipt_category")
+        existing = entry["item_categories"]
+        for line, description, category in items:
+            if line < len(existing) and existing[line].get('description') == description:
+                target = existing[line]
+            else:
+                target = next((i for i in existing if i.get('description') == description), None)
+            if target is None:
+                existing.append({"description": description, "category": category})
+            else:
+                target["category"] = category
+    atomic_write_json(path, data)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] in (["set"], ["retry"]):
+        # The worker rewrites this file too
+        from jobs import writer_lock
+        lock = writer_lock()
+    rules = ItemRules()
+
+    if len(sys.argv) == 4 and sys.argv[1] == "set":
+        key = rules.set_override(sys.argv[2], sys.argv[3])
+        rules.save()
+        print(f"{key} → {sys.argv[3]}")
+    elif sys.argv[1:] == ["retry"]:
+        print(f"{len(rules.attempted)} unresolved items will be sent to the LLM again on the next run.")
+        rules.attempted.clear()
+        rules.save()
+    elif len(sys.argv) == 1:
+        for key, rule in sorted(rules.rules.items()):
+            print(f"  {key:35s}  {rule['category']:28s}  {rule['source']}")
+        print(f"\nItems resolved by the dictionary: {rules.stats['rule_hits']}")
+        print(f"Items sent to the LLM:            {rules.stats['sent_to_llm']}")
+        print(f"Unresolved after the LLM:         {len(rules.attempted)}")
+    else:
+        raise SystemExit('Usage: python item_rules.py [set "<item description>" "<category>" | retry]')
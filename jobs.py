@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import traceback
+import subprocess
+from contextlib import closing
+import metrics
+from metrics import timed, write_prometheus
+
+JOBS_DB = "outputs/jobs.db"
+WORKER_LOCK = "outputs/worker.lock"
+POLL_SECONDS = 1.0
+
+
+# SQLite-backed job queue shared by the web app (producer) and a single worker
+# process (consumer). Identical pending jobs collapse into one via dedupe_key.
+class JobQueue:
+    def __init__(self, path=JOBS_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    dedupe_key TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key, status)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, kind, payload, dedupe_key=None):
+        dedupe_key = dedupe_key or f"{kind}:{json.dumps(payload, sort_keys=True)}"
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE dedupe_key = ? AND status = 'pending'",
+                (dedupe_key,)
+            ).fetchone()
+            if row:
+                conn.execute("COMMIT")
+                return row["id"]
+
+            cur = conn.execute(
+                "INSERT INTO jobs (kind, payload, dedupe_key, status, created_at) VALUES (?, ?, ?, 'pending', ?)",
+                (kind, json.dumps(payload), dedupe_key, time.time())
+            )
+            conn.execute("COMMIT")
+            return cur.lastrowid
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def claim(self):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                    (time.time(), row["id"])
+                )
+            conn.execute("COMMIT")
+            return self._to_dict(row) if row else None
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def finish(self, job_id, result=None, error=None):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                ("failed" if error else "done", json.dumps(result, default=str), error, time.time(), job_id)
+            )
+
+    def requeue_running(self):
+        # Jobs left 'running' by a worker that died; only called by the lock holder
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE jobs SET status = 'pending', started_at = NULL WHERE status = 'running'")
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def _to_dict(self, row):
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+
+def acquire_worker_lock(path=WORKER_LOCK):
+    # OS-level exclusive lock, released automatically if the worker dies. Only
+    # the holder may write outputs/, which makes the worker the single writer.
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    handle = open(path, "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+def writer_lock(path=WORKER_LOCK):
+    # For command-line scripts that write outputs/: hold the worker's lock for
+    # the rest of the process, or refuse to run while the worker is up
+    lock = acquire_worker_lock(path)
+    if lock is None:
+        raise SystemExit("The background worker (python jobs.py) is writing outputs/. "
+                         "Wait for it to go idle and exit, or queue the work from the web app.")
+    metrics.RECORDING = True
+    return lock
+
+
+def worker_running(path=WORKER_LOCK):
+    handle = acquire_worker_lock(path)
+    if handle is None:
+        return True
+    handle.close()
+    return False
+
+
+def start_worker(idle_exit=300):
+    if worker_running():
+        return False
+
+    kwargs = {}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--idle-exit", str(idle_exit)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        **kwargs
+    )
+    return True
+
+
+def run_job(pipeline, job):
+    with timed(f"job.{job['kind']}"):
+        return _run_job(pipeline, job)
+
+
+def _run_job(pipeline, job):
+    if job["kind"] == "scan":
+        result = pipeline.process_image(job["payload"]["image_file"])
+        return {"status": result["status"], "image_file": result["image_file"], "category": result["category"]}
+    if job["kind"] == "analyze":
+        pipeline.run_analysis()
+        return {"status": "done"}
+    raise ValueError(f"Unknown job kind: {job['kind']}")
+
+
+def enqueue_new_images(queue, pipeline, names):
+    # Same dedupe key as the web app's uploads, so a receipt saved through the
+    # app and spotted by the watcher is scanned once
+    for name, digest in pipeline.prefetch(names).items():
+        queue.enqueue("scan", {"image_file": name}, f"scan:{digest}")
+
+
+def run_worker(idle_exit=None, watch=False, scanner_options=None):
+    lock = acquire_worker_lock()
+    if lock is None:
+        print("Another worker is already running.")
+        return
+    metrics.RECORDING = True
+
+    from pipeline import Pipeline
+    from dataset import export_tables
+
+    queue = JobQueue()
+    queue.requeue_running()
+    # Watched folders get receipts in bursts: analyze once per burst, not per receipt
+    pipeline = Pipeline(analyze=not watch, **(scanner_options or {}))
+    idle_since = time.time()
+
+    watcher = None
+    poll_seconds = POLL_SECONDS
+    if watch:
+        from watch import FolderWatcher, WATCH_INTERVAL, HAS_WATCHDOG
+        # Files already in the index were scanned by an earlier run
+        watcher = FolderWatcher(pipeline.scanner.IMAGES_DIR, seen=pipeline.scanner.index.files)
+        poll_seconds = WATCH_INTERVAL
+        print(f"Watching {watcher.folder} ({'watchdog' if HAS_WATCHDOG else 'polling'})...")
+
+    print("Worker started. Waiting for jobs...")
+    dirty = False
+    try:
+        while True:
+            if watcher:
+                ready = watcher.poll()
+                if ready:
+                    enqueue_new_images(queue, pipeline, ready)
+
+            job = queue.claim()
+            if job is None:
+                if pipeline.analysis_stale:
+                    # Same dedupe key as the web app's "Analyze" button
+                    pipeline.analysis_stale = False
+                    queue.enqueue("analyze", {}, "analyze")
+                    continue
+                if dirty:
+                    # Queue drained: catch up on work deferred from the jobs.
+                    # Re-exporting the tables costs seconds on a large store,
+                    # so a burst of uploads pays for it once, not per receipt.
+                    pipeline.flush()
+                    export_tables()
+                    write_prometheus()
+                    dirty = False
+                if idle_exit and not watcher and time.time() - idle_since > idle_exit:
+                    print("Idle, exiting.")
+                    break
+                time.sleep(poll_seconds)
+                continue
+
+            print(f"Job {job['id']}: {job['kind']} {job['payload']}")
+            try:
+                queue.finish(job["id"], result=run_job(pipeline, job))
+            except Exception as e:
+                traceback.print_exc()
+                queue.finish(job["id"], error=f"{type(e).__name__}: {e}")
+            dirty = True
+            idle_since = time.time()
+    finally:
+        # Don't lose deferred work when stopped mid-batch
+        if dirty:
+            pipeline.flush()
+            export_tables()
+            write_prometheus()
+        if watcher:
+            watcher.close()
+        lock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TrackWise background worker")
+    parser.add_argument("--idle-exit", type=float, default=None,
+                        help="exit after this many seconds without jobs")
+    parser.add_argument("--watch", action="store_true",
+                        help="also scan new files dropped into images/ as they arrive (runs until stopped)")
+    args = parser.parse_args()
+    try:
+        run_worker(args.idle_exit, watch=args.watch)
+    except KeyboardInterrupt:
+        print("Stopped.")
@@ -0,0 +1,32 @@
+import os
+import time
+from disk_cache import DiskCache
+
+CACHE_DIR = "outputs/llm_cache"
+TTL_SECONDS = int(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+
+
+# Parsed agent replies keyed by (model, agent role, rendered task description).
+# Entries older than ttl are treated as misses and dropped.
+class LLMCache(DiskCache):
+    def __init__(self, folder=CACHE_DIR, ttl=TTL_SECONDS, max_bytes=MAX_BYTES):
+        super().__init__(folder, max_bytes)
+        self.ttl = ttl
+
+    def key(self, model, role, description):
+        return self.make_key(model, role, description)
+
+    def get(self, key):
+        entry = super().get(key)
+        if entry is None:
+            return None
+        if time.time() - entry["created_at"] > self.ttl:
+            self.delete(key)
+            self.hits -= 1
+            self.misses += 1
+            return None
+        return entry["value"]
+
+    def put(self, key, value):
+        super().put(key, {"created_at": time.time(), "value": value})
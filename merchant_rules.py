@@ -0,0 +1,123 @@
+import re
+import sys
+import math
+from storage import read_json, atomic_write_json
+
+RULES_FILE = "outputs/merchant_rules.json"
+MIN_CONFIDENCE = 85
+
+# Chains whose receipts often print a slogan or store details instead of a name
+ALIASES = [
+    (re.compile(r"walmart|save money\W*live better"), "walmart"),
+    (re.compile(r"trader joe"), "trader joe's"),
+]
+
+PHONE = re.compile(r"\(?\s*\d{3}\s*\)?[\s.-]*\d{3}[\s.-]*\d{4}")
+
+
+def normalize_merchant(name):
+    if not name:
+        return None
+    text = name.lower()
+
+    for pattern, canonical in ALIASES:
+        if pattern.search(text):
+            return canonical
+
+    text = PHONE.sub(" ", text)
+    text = re.sub(r"[^a-z&' ]+", " ", text)
+    text = " ".join(text.split())
+
+    if not text or text == "unknown":
+        return None
+    return text
+
+
+# Normalized merchant name -> category. Rules are learned from high-confidence
+# LLM categorizations; user overrides always win and are never relearned.
+class MerchantRules:
+    def __init__(self, path=RULES_FILE):
+        self.path = path
+        data = read_json(path, {})
+        self.rules = data.get("rules", {})
+        self.stats = data.get("stats", {"rule_hits": 0, "sent_to_llm": 0, "llm_calls_avoided": 0})
+
+    def lookup(self, merchant):
+        key = normalize_merchant(merchant)
+        return self.rules.get(key) if key else None
+
+    def learn(self, expenses, categorization, min_confidence=MIN_CONFIDENCE):
+        learned = 0
+        for e in expenses:
+            key = normalize_merchant(e.get('merchant'))
+            data = categorization.get(e['image_file'])
+            if not key or not data or data.get('source') in ('merchant_rule', 'embedding'):
+                continue
+
+            confidence = data.get('confidence') or 0
+            if confidence < min_confidence:
+                continue
+
+            current = self.rules.get(key)
+            if current and (current['source'] == 'user' or current['confidence'] > confidence):
+                continue
+
+            self.rules[key] = {"category": data['category'], "confidence": confidence, "source": "learned"}
+            learned += 1
+        return learned
+
+    def set_override(self, merchant, category):
+        key = normalize_merchant(merchant)
+        if not key:
+            raise ValueError(f"Cannot build a rule for merchant {merchant!r}")
+        self.rules[key] = {"category": category, "confidence": 100, "source": "user"}
+        return key
+
+    def resolve(self, expenses, batch_size=1):
+        resolved = {}
+        unknown = []
+        for e in expenses:
+            rule = self.lookup(e.get('merchant'))
+            if rule:
+                resolved[e['image_file']] = {
+                    "category": rule['category'],
+                    "confidence": rule['confidence'],
+                    "reasoning": f"{rule['source']} merchant rule",
+                    "source": "merchant_rule"
+                }
+            else:
+                unknown.append(e)
+
+        avoided = math.ceil(len(expenses) / batch_size) - math.ceil(len(unknown) / batch_size)
+        self.stats['rule_hits'] += len(resolved)
+        self.stats['sent_to_llm'] += len(unknown)
+        self.stats['llm_calls_avoided'] += avoided
+        return resolved, unknown, avoided
+
+    def save(self):
+        atomic_write_json(self.path, {"rules": self.rules, "stats": self.stats})
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["set"]:
+        # The worker rewrites this file too
+        from jobs import writer_lock
+        lock = writer_lock()
+    rules = MerchantRules()
+
+    if len(sys.argv) == 4 and sys.argv[1] == "set":
+        from agents import CATEGORIES
+        merchant, category = sys.argv[2], sys.argv[3]
+        if category not in CATEGORIES:
+            raise SystemExit(f"Unknown category {category!r}. Choose from: {', '.join(CATEGORIES)}")
+        key = rules.set_override(merchant, category)
+        rules.save()
+        print(f"{key} → {category}")
+    elif len(sys.argv) == 1:
+        for key, rule in sorted(rules.rules.items()):
+            print(f"  {key:35s}  {rule['category']:28s}  {rule['source']} ({rule['confidence']})")
+        print(f"\nReceipts resolved by rules: {rules.stats['rule_hits']}")
+        print(f"Receipts sent to the LLM:   {rules.stats['sent_to_llm']}")
+        print(f"LLM calls avoided:          {rules.stats['llm_calls_avoided']}")
+    else:
+        raise SystemExit('Usage: python merchant_rules.py [set "<merchant>" "<category>"]')
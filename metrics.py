@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+METRICS_FILE = "outputs/metrics.jsonl"
+PROMETHEUS_FILE = "outputs/metrics.prom"
+METRICS_MAX_BYTES = 10 * 1024 * 1024
+ENABLED = os.environ.get("TRACKWISE_METRICS", "1") != "0"
+# Set by the process holding the worker lock (jobs.writer_lock, run_worker).
+# Readers such as the web app record nothing, so a single process appends to
+# and rotates the file.
+RECORDING = False
+
+_lock = threading.Lock()
+
+
+def record(stage, seconds, ok=True, path=METRICS_FILE, **fields):
+    # One JSON line per event; rotated to .1 past METRICS_MAX_BYTES
+    if not (ENABLED and RECORDING):
+        return
+    event = {"ts": round(time.time(), 3), "stage": stage, "seconds": round(seconds, 6), "ok": ok, **fields}
+    line = json.dumps(event, default=str) + "\n"
+    with _lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path) and os.path.getsize(path) > METRICS_MAX_BYTES:
+            os.replace(path, path + ".1")
+        with open(path, "a") as f:
+            f.write(line)
+
+
+@contextmanager
+def timed(stage, **fields):
+    # Times the block and records it; the block can add fields (tokens, cache
+    # result, ok=False...) to the yielded dict. Exceptions count as failures.
+    event = dict(fields)
+    start = time.perf_counter()
+    try:
+        yield event
+    except BaseException as e:
+        event["ok"] = False
+        event["error"] = type(e).__name__
+        raise
+    finally:
+        record(stage, time.perf_counter() - start, **{"ok": True, **event})
+
+
+def record_usage(event, usage):
+    # Token counts from a CrewOutput.token_usage (UsageMetrics)
+    if usage is None:
+        return
+    event["prompt_tokens"] = getattr(usage, "prompt_tokens", 0) or 0
+    event["completion_tokens"] = getattr(usage, "completion_tokens", 0) or 0
+    event["requests"] = getattr(usage, "successful_requests", 0) or 0
+
+
+def load_events(path=METRICS_FILE, since=None):
+    events = []
+    for name in (path + ".1", path):
+        if not os.path.exists(name):
+            continue
+        with open(name) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if since is None or event.get("ts", 0) >= since:
+                    events.append(event)
+    return events
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0
+
+
+def summarize(events):
+    stages = {}
+    durations = {}
+    for e in events:
+        s = stages.setdefault(e["stage"], {
+            "count": 0, "seconds": 0.0, "failures": 0, "prompt_tokens": 0,
+            "completion_tokens": 0, "cache_hits": 0, "cache_misses": 0
+        })
+        s["count"] += 1
+        s["seconds"] += e.get("seconds", 0)
+        s["failures"] += not e.get("ok", True)
+        s["prompt_tokens"] += e.get("prompt_tokens", 0)
+        s["completion_tokens"] += e.get("completion_tokens", 0)
+        if e.get("cache") == "hit":
+            s["cache_hits"] += 1
+        elif e.get("cache") == "miss":
+            s["cache_misses"] += 1
+        durations.setdefault(e["stage"], []).append(e.get("seconds", 0))
+
+    for stage, values in durations.items():
+        stages[stage]["p50"] = _percentile(values, 0.5)
+        stages[stage]["p95"] = _percentile(values, 0.95)
+    return stages
+
+
+def prometheus_text(summary):
+    lines = [
+        "# HELP trackwise_stage_seconds Time spent in each pipeline stage.",
+        "# TYPE trackwise_stage_seconds summary",
+    ]
+    for stage, s in sorted(summary.items()):
+        lines.append(f'trackwise_stage_seconds{{stage="{stage}",quantile="0.5"}} {s["p50"]:.6f}')
+        lines.append(f'trackwise_stage_seconds{{stage="{stage}",quantile="0.95"}} {s["p95"]:.6f}')
+        lines.append(f'trackwise_stage_seconds_sum{{stage="{stage}"}} {s["seconds"]:.6f}')
+        lines.append(f'trackwise_stage_seconds_count{{stage="{stage}"}} {s["count"]}')
+
+    counters = [
+        ("trackwise_stage_failures_total", "Failed stage runs.", lambda s: [("", s["failures"])]),
+        ("trackwise_llm_tokens_total", "LLM tokens used.",
+         lambda s: [(',kind="prompt"', s["prompt_tokens"]), (',kind="completion"', s["completion_tokens"])]),
+        ("trackwise_cache_requests_total", "Cache lookups.",
+         lambda s: [(',result="hit"', s["cache_hits"]), (',result="miss"', s["cache_misses"])]),
+    ]
+    for name, help_text, values in counters:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for stage, s in sorted(summary.items()):
+            for labels, value in values(s):
+                lines.append(f'{name}{{stage="{stage}"{labels}}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path=PROMETHEUS_FILE, metrics_path=METRICS_FILE):
+    # Textfile-collector format (node_exporter --collector.textfile.directory)
+    if not ENABLED:
+        return
+    text = prometheus_text(summarize(load_events(metrics_path)))
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+if __name__ == "__main__":
+    summary = summarize(load_events())
+    print(f"{'stage':<40} {'runs':>6} {'avg ms':>9} {'p95 ms':>9} {'fail':>5} {'tokens':>9} {'cache hit':>10}")
+    for stage, s in sorted(summary.items()):
+        lookups = s["cache_hits"] + s["cache_misses"]
+        hit_rate = f"{s['cache_hits'] / lookups:.0%}" if lookups else "-"
+        print(f"{stage:<40} {s['count']:>6} {s['seconds'] / s['count'] * 1000:>9.1f} {s['p95'] * 1000:>9.1f} "
+              f"{s['failures']:>5} {s['prompt_tokens'] + s['completion_tokens']:>9} {hit_rate:>10}")
+    write_prometheus()
@@ -0,0 +1,249 @@
+import os
+import re
+import time
+import random
+import shutil
+import subprocess
+import requests
+from requests.adapters import HTTPAdapter
+from ratelimit import TokenBucket, CircuitBreaker, CircuitOpenError, parse_retry_after
+
+OCR_BACKEND = os.environ.get("OCR_BACKEND", "asprise")
+ASPRISE_URL = "https://ocr2.asprise.com/api/v1/receipt"
+
+# Requests per second to start at and never exceed; backs off on 429/5xx
+OCR_RATE = float(os.environ.get("OCR_RATE", 10))
+OCR_RETRIES = int(os.environ.get("OCR_RETRIES", 4))
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BREAKER_THRESHOLD = int(os.environ.get("OCR_BREAKER_THRESHOLD", 5))
+BREAKER_COOLDOWN = float(os.environ.get("OCR_BREAKER_COOLDOWN", 30))
+
+
+# Remote Asprise receipt API (the original and default backend). Returns its
+# JSON reply as is; extract_fields reads receipts[0] from it. One keep-alive
+# session is shared by all scanner threads, paced by an adaptive token bucket;
+# throttled or failed calls are retried with jittered backoff, and a circuit
+# breaker stops hammering the service while it is down.
+class AspriseBackend:
+    name = "asprise"
+    workers = None
+
+    def __init__(self, url=None, api_key="TEST", recognizer="auto", timeout=60, pool_size=16,
+                 rate=OCR_RATE, retries=OCR_RETRIES):
+        self.url = url or os.environ.get("OCR_URL", ASPRISE_URL)
+        self.api_key = api_key
+        self.recognizer = recognizer
+        self.timeout = timeout
+        self.retries = retries
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.bucket = TokenBucket(rate)
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+
+    def settings(self):
+        return {"recognizer": self.recognizer}
+
+    def _post(self, image_bytes, filename):
+        return self.session.post(
+            self.url,
+            data = {
+                'api_key': self.api_key,
+                'recognizer': self.recognizer,
+                'ref_no': 'ocr_python_123'
+            },
+            files = {"file": (filename, image_bytes)},
+            timeout = self.timeout
+        )
+
+    def recognize(self, image_bytes, filename):
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"OCR service unavailable, not retrying for {self.breaker.cooldown:g}s")
+
+        # Every way out settles the breaker, or a half-open trial would stay
+        # pending and keep the circuit open for good
+        ok = False
+        try:
+            data = self._recognize(image_bytes, filename)
+            ok = data is not False
+            return data or None
+        finally:
+            if ok:
+                self.breaker.success()
+            else:
+                self.breaker.failure()
+
+    def _recognize(self, image_bytes, filename):
+        # JSON reply, None if rejected for good, False once retries run out
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # Full jitter keeps the scanner threads from retrying in lockstep
+                time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)))
+            self.bucket.acquire()
+            try:
+                response = self._post(image_bytes, filename)
+            except requests.RequestException as e:
+                error = e
+                continue
+
+            if response.status_code == 200:
+                self.bucket.on_success()
+                return response.json()
+            if response.status_code not in RETRY_STATUSES:
+                # Rejected for good (bad key, unreadable file); the service is up
+                return None
+
+            error = None
+            self.bucket.on_throttle(parse_retry_after(response.headers.get("Retry-After")))
+
+        if error is not None:
+            raise error
+        return False
+
+
+# Local Tesseract CLI plus a rule-based receipt parser, answering in the same
+# shape as Asprise. Each call is its own tesseract process, so the scanner's
+# thread pool (sized to the CPU count) keeps every core busy, offline.
+class TesseractBackend:
+    name = "tesseract"
+
+    def __init__(self, lang="eng", binary="tesseract", timeout=120):
+        self.binary = shutil.which(binary)
+        if not self.binary:
+            raise RuntimeError("tesseract is not installed (https://github.com/tesseract-ocr/tesseract)")
+        self.lang = lang
+        self.timeout = timeout
+        self.workers = os.cpu_count() or 4
+
+    def settings(self):
+        return {"backend": self.name, "lang": self.lang}
+
+    def recognize(self, image_bytes, filename):
+        # psm 4: a single column of text of variable sizes, i.e. a receipt.
+        # One thread per process; parallelism comes from running many at once.
+        result = subprocess.run(
+            [self.binary, "stdin", "stdout", "-l", self.lang, "--psm", "4"],
+            input=image_bytes,
+            capture_output=True,
+            timeout=self.timeout,
+            env={**os.environ, "OMP_THREAD_LIMIT": "1"}
+        )
+        if result.returncode != 0:
+            return None
+
+        receipt = parse_receipt_text(result.stdout.decode("utf-8", errors="replace"))
+        return {"success": True, "receipts": [receipt] if receipt else []}
+
+
+BACKENDS = {
+    "asprise": AspriseBackend,
+    "tesseract": TesseractBackend,
+}
+
+
+def make_backend(name=None, **options):
+    name = name or OCR_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown OCR backend {name!r}. Choose from: {', '.join(BACKENDS)}")
+    backend = BACKENDS[name]
+    if name != "asprise":
+        # Only the HTTP backend takes url/api_key/recognizer/pool_size
+        options = {k: v for k, v in options.items() if k == "timeout"}
+    return backend(**options)
+
+
+AMOUNT = r"-?\d{1,6}[.,]\d{2}"
+AMOUNT_AT_END = re.compile(rf"({AMOUNT})\s*-?\s*[A-Z]?\s*$")
+QTY = re.compile(r"^(\d+(?:\.\d+)?)\s*[@xX]\s*")
+DATE_PATTERNS = [
+    (re.compile(r"\b(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b"), ("y", "m", "d")),
+    (re.compile(r"\b(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})\b"), ("m", "d", "y")),
+    (re.compile(r"\b(\d{1,2})[-/.](\d{1,2})[-/.](\d{2})\b"), ("m", "d", "y")),
+]
+TIME = re.compile(r"\b([01]?\d|2[0-3]):([0-5]\d)(?::[0-5]\d)?\s*([AaPp][Mm])?")
+SKIP_LINE = re.compile(r"change|cash|tend|visa|master|card|debit|credit|balance|due|paid|auth|approv|items? sold", re.I)
+
+
+def _amount(text):
+    return round(float(text.replace(",", ".")), 2)
+
+
+def _date(line):
+    for pattern, order in DATE_PATTERNS:
+        match = pattern.search(line)
+        if not match:
+            continue
+        parts = dict(zip(order, (int(g) for g in match.groups())))
+        year = parts["y"] + 2000 if parts["y"] < 100 else parts["y"]
+        month, day = parts["m"], parts["d"]
+        if month > 12 and day <= 12:
+            month, day = day, month
+        if 1 <= month <= 12 and 1 <= day <= 31:
+            return f"{year:04d}-{month:02d}-{day:02d}"
+    return None
+
+
+def _time(line):
+    match = TIME.search(line)
+    if not match:
+        return None
+    hour, minute, meridiem = int(match.group(1)), match.group(2), (match.group(3) or "").lower()
+    if meridiem == "pm" and hour < 12:
+        hour += 12
+    elif meridiem == "am" and hour == 12:
+        hour = 0
+    return f"{hour:02d}:{minute}"
+
+
+def parse_receipt_text(text):
+    # Best-effort receipt fields from plain OCR text, named like Asprise's
+    # receipts[0] so extract_fields works unchanged
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    if not lines:
+        return None
+
+    receipt = {
+        "merchant_name": next((line for line in lines[:5] if re.search(r"[A-Za-z]{3}", line)), None),
+        "date": None, "time": None, "total": None, "subtotal": None, "tax": None, "items": []
+    }
+
+    for line in lines:
+        receipt["date"] = receipt["date"] or _date(line)
+        receipt["time"] = receipt["time"] or _time(line)
+
+        match = AMOUNT_AT_END.search(line)
+        if not match:
+            continue
+        amount = _amount(match.group(1))
+        label = line[:match.start()].strip()
+        lower = label.lower()
+
+        if "subtotal" in lower.replace(" ", "").replace("-", ""):
+            receipt["subtotal"] = amount
+        elif re.search(r"\btotal\b", lower):
+            # The grand total is usually the largest "total" line
+            receipt["total"] = max(amount, receipt["total"] or amount)
+        elif re.search(r"\b(tax|vat|gst)\b", lower):
+            receipt["tax"] = round((receipt["tax"] or 0) + amount, 2)
+        elif label and not SKIP_LINE.search(label) and re.search(r"[A-Za-z]{2}", label):
+            qty = QTY.match(label)
+            receipt["items"].append({
+                "amount": amount,
+                "category": None,
+                "description": label[qty.end():] if qty else label,
+                "flags": "",
+                "qty": float(qty.group(1)) if qty else None,
+                "remarks": None,
+                "tags": None,
+                "unitPrice": None
+            })
+
+    if receipt["total"] is None and receipt["items"]:
+        receipt["total"] = round(sum(i["amount"] for i in receipt["items"]) + (receipt["tax"] or 0), 2)
+    return receipt
@@ -0,0 +1,12 @@
+from disk_cache import DiskCache
+
+CACHE_DIR = "outputs/ocr_cache"
+
+
+# Raw OCR responses keyed by image content hash plus recognizer settings
+class OCRCache(DiskCache):
+    def __init__(self, folder=CACHE_DIR, max_bytes=200 * 1024 * 1024):
+        super().__init__(folder, max_bytes)
+
+    def key(self, digest, settings):
+        return self.make_key(digest, settings)
@@ -0,0 +1,167 @@
+import re
+import json
+
+_decoder = json.JSONDecoder()
+
+
+def extract_json(text):
+    # str() of a crew result is its raw reply, already JSON in structured mode
+    text = str(text)
+    text = re.sub(r'```(?:json)?\s*', '', text)
+    start = text.find('{')
+    if start == -1:
+        return None
+
+    try:
+        data, _ = _decoder.raw_decode(text, start)
+        return data
+    except ValueError:
+        pass
+
+    end = text.rfind('}') + 1
+    try:
+        return json.loads(text[start:end])
+    except ValueError:
+        return None
+
+
+def salvage_fields(text, fields):
+    # Pull individual top-level values out of a reply that isn't valid JSON as
+    # a whole (truncated output, trailing prose, a broken sibling field...)
+    text = str(text)
+    found = {}
+    for field in fields:
+        match = re.search(r'"%s"\s*:\s*' % re.escape(field), text)
+        if not match:
+            continue
+        try:
+            found[field], _ = _decoder.raw_decode(text, match.end())
+        except ValueError:
+            continue
+    return found
+
+
+def _string_list(value):
+    if not isinstance(value, list):
+        return None
+    return [str(v) for v in value if isinstance(v, (str, int, float)) and str(v).strip()]
+
+
+def _clean_category(data, categories):
+    if not isinstance(data, dict):
+        return None
+
+    category = str(data.get('category', '')).strip()
+    matches = [c for c in categories if c.lower() == category.lower()]
+    if not matches:
+        return None
+
+    try:
+        confidence = int(float(data.get('confidence', 50)))
+    except (TypeError, ValueError):
+        confidence = 50
+
+    return {
+        "category": matches[0],
+        "confidence": max(0, min(100, confidence)),
+        "reasoning": str(data.get('reasoning') or "")
+    }
+
+
+def parse_categorization(text, names, categories):
+    names = set(names)
+    data = extract_json(text)
+
+    if isinstance(data, dict) and isinstance(data.get('receipts'), list):
+        data = {
+            entry.get('image_file'): entry
+            for entry in data['receipts'] if isinstance(entry, dict)
+        }
+
+    if not isinstance(data, dict):
+        # Salvage every complete receipt object we can find, in either the
+        # {"receipts": [...]} shape or the older {"file.jpg": {...}} one
+        text = str(text)
+        data = {}
+        for match in re.finditer(r'\{', text):
+            try:
+                entry, _ = _decoder.raw_decode(text, match.start())
+            except ValueError:
+                continue
+            if isinstance(entry, dict) and entry.get('image_file') in names:
+                data[entry['image_file']] = entry
+        for match in re.finditer(r'"([^"]+)"\s*:\s*(?=\{)', text):
+            if match.group(1) not in names or match.group(1) in data:
+                continue
+            try:
+                data[match.group(1)], _ = _decoder.raw_decode(text, match.end())
+            except ValueError:
+                continue
+
+    result = {}
+    for img, entry in data.items():
+        if img not in names:
+            continue
+        cleaned = _clean_category(entry, categories)
+        if cleaned:
+            result[img] = cleaned
+
+    return result or None
+
+
+def parse_item_categories(text, descriptions):
+    descriptions = set(descriptions)
+    data = extract_json(text)
+
+    if isinstance(data, dict) and isinstance(data.get('items'), list):
+        entries = data['items']
+    else:
+        # Salvage every complete {"description": ..., "category": ...} object
+        text = str(text)
+        entries = []
+        for match in re.finditer(r'\{', text):
+            try:
+                entry, _ = _decoder.raw_decode(text, match.start())
+            except ValueError:
+                continue
+            entries.append(entry)
+
+    result = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or entry.get('description') not in descriptions:
+            continue
+        category = entry.get('category')
+        if isinstance(category, str) and category.strip():
+            result[entry['description']] = category.strip()
+
+    return result or None
+
+
+def parse_analysis(text):
+    data = extract_json(text)
+    if not isinstance(data, dict):
+        data = salvage_fields(text, ["insights", "anomalies"])
+
+    result = {}
+    for field in ("insights", "anomalies"):
+        values = _string_list(data.get(field))
+        if values is not None:
+            result[field] = values
+
+    return result or None
+
+
+def parse_advice(text):
+    data = extract_json(text)
+    if not isinstance(data, dict):
+        data = salvage_fields(text, ["budget_status", "tips", "quick_win", "positive"])
+
+    result = {}
+    tips = _string_list(data.get('tips'))
+    if tips is not None:
+        result['tips'] = tips
+    for field in ("budget_status", "quick_win", "positive"):
+        if isinstance(data.get(field), str) and data[field].strip():
+            result[field] = data[field].strip()
+
+    return result or None
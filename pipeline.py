@@ -0,0 +1,106 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from extract_data import OCR_SCAN
+from storage import read_json, atomic_write_json, file_sha256
+from item_rules import export_categorized
+import run
+
+
+# Scan → extract → categorize → aggregate for one receipt at a time, in
+# process. Meant to be created once and kept warm (the web app caches it), so
+# CrewAI, the expense store and the caches are loaded only once.
+class Pipeline:
+    def __init__(self, analyze=True, **scanner_options):
+        self.scanner = OCR_SCAN(**scanner_options)
+        self._lock = threading.Lock()
+        # With analyze=False uploads stop at the aggregates and set
+        # analysis_stale; the caller runs run_analysis() once for a batch
+        self.analyze = analyze
+        self.analysis_stale = False
+        # Line items categorized since the last flush()
+        self._categorized = {}
+
+    def prefetch(self, names):
+        # OCR a burst of new images in parallel ahead of their scan jobs; the
+        # replies land in the OCR cache, so each job only extracts,
+        # categorizes and aggregates. Returns {name: digest} of new images.
+        scanner = self.scanner
+        digests = {}
+        for name in names:
+            if scanner.index.has_file(name):
+                continue
+            digest = file_sha256(os.path.join(scanner.IMAGES_DIR, name))
+            if not scanner.index.lookup(digest):
+                digests[name] = digest
+
+        if len(digests) > 1:
+            with ThreadPoolExecutor(max_workers=scanner.MAX_WORKERS) as pool:
+                list(pool.map(scanner._scan_file, digests.items()))
+        return digests
+
+    def process_image(self, name):
+        with self._lock:
+            self.scanner.refresh()
+            result = self._process(name)
+
+            if result["status"] == "duplicate" and result["expense"] and result["expense"]['image_file'] != name:
+                # Renamed copy of a stored receipt; don't leave it in the folder
+                os.remove(os.path.join(self.scanner.IMAGES_DIR, name))
+            return result
+
+    def _process(self, name):
+        status, expense = self.scanner.process_file(name)
+        result = {"status": status, "image_file": name, "expense": expense, "category": None}
+        if status == "failed":
+            return result
+
+        old_data = read_json(run.OUTPUT_FILE) or {}
+        old_categorization = old_data.get("categorization", {})
+
+        if expense['image_file'] in old_categorization:
+            if status == "saved":
+                self.scanner.aggregates.save()
+            result["category"] = old_categorization[expense['image_file']]
+            return result
+
+        categorization_new = run.categorize_new_expenses([expense], self.scanner.expenses, old_categorization)
+        categorization = {**old_categorization, **categorization_new}
+
+        aggregates = self.scanner.aggregates
+        aggregates.ensure(self.scanner.expenses, old_categorization)
+        aggregates.sync([expense], categorization_new)
+        aggregates.save()
+
+        categorized = run.categorize_items(self.scanner.store, categorization, [expense['image_file']], export=False)
+        if categorized:
+            self.scanner.expenses = self.scanner.store.all()
+            self._categorized.update(categorized)
+
+        if not self.analyze:
+            # Keep the stored analysis; run_expense_crew refreshes it later
+            atomic_write_json(run.OUTPUT_FILE, {**old_data, "categorization": categorization, "analysis_stale": True})
+            self.analysis_stale = True
+            result["category"] = categorization.get(expense['image_file'])
+            return result
+
+        final_output = run.update_analysis(old_data, categorization, aggregates)
+        result["category"] = final_output["categorization"].get(expense['image_file'])
+        return result
+
+    def flush(self):
+        # Deferred per-upload bookkeeping, run once the worker's queue drains:
+        # one categorized.json merge for all the receipts since the last flush
+        with self._lock:
+            if not self._categorized:
+                return
+            categorization = (read_json(run.OUTPUT_FILE) or {}).get("categorization", {})
+            export_categorized(self._categorized, categorization)
+            self._categorized = {}
+
+    def run_analysis(self):
+        with self._lock:
+            output = run.run_expense_crew()
+            self.scanner.refresh()
+            self.scanner.aggregates = self.scanner.load_aggregates()
+            return output
@@ -0,0 +1,81 @@
+import io
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+    HAS_PILLOW = True
+except ImportError:
+    HAS_PILLOW = False
+
+# Thermal receipts are ~80 mm (3.15 in) wide; OCR needs no more than ~300 DPI
+RECEIPT_WIDTH_INCHES = 3.15
+
+DEFAULT_SETTINGS = {
+    "dpi": int(os.environ.get("OCR_PREPROCESS_DPI", 300)),
+    "quality": int(os.environ.get("OCR_PREPROCESS_QUALITY", 85)),
+    "grayscale": os.environ.get("OCR_PREPROCESS_GRAYSCALE", "1") != "0",
+}
+
+
+def preprocess_image(data, dpi=300, quality=85, grayscale=True):
+    # EXIF rotation, grayscale, downscale so the short side (the receipt's
+    # width) is at most `dpi` pixels per inch, re-encode as JPEG. Returns the
+    # original bytes when that would not make the upload smaller.
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("L" if grayscale else "RGB")
+
+    target = int(RECEIPT_WIDTH_INCHES * dpi)
+    short_side = min(image.size)
+    if short_side > target:
+        scale = target / short_side
+        image = image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=quality, optimize=True)
+    processed = out.getvalue()
+    if len(processed) >= len(data):
+        return data, False
+    return processed, True
+
+
+def _preprocess(args):
+    data, settings = args
+    return preprocess_image(data, **settings)
+
+
+# Runs preprocess_image in a process pool (it is CPU-bound, and the scanner's
+# upload threads would otherwise serialize on the GIL) and counts bytes saved.
+class Preprocessor:
+    def __init__(self, settings=None, workers=None):
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def run(self, data):
+        try:
+            processed, changed = self.pool.submit(_preprocess, (data, self.settings)).result()
+        except (OSError, ValueError) as e:
+            # Not an image Pillow can read; let the OCR service try the original
+            print(f"Preprocessing failed ({e}); uploading original image.")
+            processed, changed = data, False
+        with self._lock:
+            self.bytes_in += len(data)
+            self.bytes_out += len(processed)
+        return processed, changed
+
+    def stats(self):
+        saved = self.bytes_in - self.bytes_out
+        return {
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "saved": saved,
+            "ratio": saved / self.bytes_in if self.bytes_in else 0
+        }
+
+    def close(self):
+        self.pool.shutdown()
@@ -0,0 +1,100 @@
+import time
+import threading
+import email.utils
+import requests
+
+
+class CircuitOpenError(requests.RequestException):
+    pass
+
+
+def parse_retry_after(value, limit=60):
+    # Retry-After is either seconds or an HTTP date; capped so a bad header
+    # can't stall a scan for hours
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0), limit)
+
+
+# Token bucket shared by all scanner threads. The rate adapts AIMD-style:
+# halved on every throttle (429/5xx), then grown back a step per success up
+# to max_rate, so bulk scans settle at whatever the service allows.
+class TokenBucket:
+    def __init__(self, max_rate, burst=None, min_rate=0.2):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self.burst = burst or max(1, max_rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+
+# Stops calling a service that keeps failing: after `threshold` failed
+# requests in a row it rejects calls for `cooldown` seconds, then lets one
+# trial call through and closes again if that succeeds.
+class CircuitBreaker:
+    def __init__(self, threshold=5, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self.trial and time.monotonic() - self.opened_at >= self.cooldown:
+                self.trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial or (self.opened_at is None and self.failures >= self.threshold):
+                if not self.trial:
+                    print(f"OCR service failing; pausing calls for {self.cooldown:g}s.")
+                self.opened_at = time.monotonic()
+                self.trial = False
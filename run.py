@@ -1,117 +1,367 @@
 import json
-import re
 import os
-from agents import ExpenseAgents, ExpenseTasks
-from crewai import Crew, Process
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from agents import ExpenseAgents, ExpenseTasks, MODEL, CATEGORIES
+from storage import ExpenseStore, read_json, atomic_write_json
+from merchant_rules import MerchantRules, normalize_merchant
+from embeddings import EmbeddingIndex
+from llm_cache import LLMCache
+from aggregates import Aggregates
+from item_rules import ItemRules, normalize_descriptions, export_categorized
+from tables import items_table
+from parsing import parse_categorization, parse_item_categories, parse_analysis, parse_advice
+from metrics import timed, record_usage, write_prometheus
 
 EXPENSES_FILE = "outputs/expenses.json"
 OUTPUT_FILE = "outputs/crew_analysis.json"
 
-def clean_json_response(text):
-    text = str(text)
-    text = re.sub(r'```json\s*', '', text)
-    text = re.sub(r'```\s*', '', text)
-    start = text.find('{')
-    end = text.rfind('}') + 1
-    if start != -1 and end > start:
-        json_str = text[start:end]
-        try:
-            return json.loads(json_str)
-        except:
-            return None
-    return None
+CATEGORIZE_BATCH_SIZE = int(os.environ.get("CATEGORIZE_BATCH_SIZE", 20))
+CATEGORIZE_WORKERS = int(os.environ.get("CATEGORIZE_WORKERS", 2))
+CATEGORIZE_RETRIES = int(os.environ.get("CATEGORIZE_RETRIES", 2))
+CATEGORIZE_ITEMS_BATCH_SIZE = int(os.environ.get("CATEGORIZE_ITEMS_BATCH_SIZE", 40))
+
+# Re-run the analyzer/advisor only when some category moved by more than this
+# share of the previous total spend
+ANALYSIS_CHANGE_THRESHOLD = float(os.environ.get("ANALYSIS_CHANGE_THRESHOLD", 0.05))
+
+
+def run_task(agent, task, parse, cache=None):
+    # Replies are cached by (model, role, rendered prompt) and only once they
+    # parse, so an unchanged prompt never costs a second inference.
+    key = None
+    if cache is not None:
+        key = cache.key(MODEL, agent.role, task.description)
+        with timed("llm.cache", agent=agent.role) as event:
+            cached = cache.get(key)
+            event["cache"] = "hit" if cached is not None else "miss"
+        if cached is not None:
+            print(f"Using cached reply from {agent.role}")
+            return cached
+
+    from crewai import Crew, Process
+
+    crew = Crew(
+        agents=[agent],
+        tasks=[task],
+        process=Process.sequential,
+        verbose=False
+    )
 
+    with timed("llm.kickoff", agent=agent.role) as event:
+        output = crew.kickoff()
+        record_usage(event, getattr(output, "token_usage", None))
+    with timed("llm.parse", agent=agent.role) as event:
+        result = parse(output)
+        event["ok"] = result is not None
+    if key is not None and result is not None:
+        cache.put(key, result)
+    return result
+
+
+def categorize_batch(batch):
+    # Each batch gets its own agent and crew so batches can run in parallel
+    categorizer = ExpenseAgents().categorizer_agent()
+    task = ExpenseTasks().categorize_task(categorizer, batch)
+
+    names = [e['image_file'] for e in batch]
+
+    try:
+        return run_task(categorizer, task, lambda text: parse_categorization(text, names, CATEGORIES))
+    except Exception as e:
+        print(f"Categorizer failed on a batch of {len(batch)}: {e}")
+        return None
+
+
+def nearest_merchant_categories(expenses, rules):
+    # Merchants the rules don't know exactly, categorized by their nearest
+    # already-categorized neighbours; low-similarity ones are left for the LLM
+    index = EmbeddingIndex("merchants")
+    if not index.sync(rules.rules):
+        return {}
+
+    keys = {e['image_file']: normalize_merchant(e.get('merchant')) for e in expenses}
+    matches = index.query(sorted({key for key in keys.values() if key}))
+
+    result = {}
+    for img, key in keys.items():
+        if key in matches:
+            category, similarity = matches[key]
+            result[img] = {
+                "category": category,
+                "confidence": round(similarity * 100),
+                "reasoning": "similar to known merchants",
+                "source": "embedding"
+            }
+    return result
+
+
+def categorize_expenses(expenses, batch_size=CATEGORIZE_BATCH_SIZE,
+                        workers=CATEGORIZE_WORKERS, retries=CATEGORIZE_RETRIES):
+    pending = [expenses[i:i + batch_size] for i in range(0, len(expenses), batch_size)]
+    categorization = {}
+
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        if attempt:
+            print(f"Retrying {len(pending)} batches that failed to parse...")
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for batch, result in zip(pending, pool.map(categorize_batch, pending)):
+                if result is None:
+                    failed.append(batch)
+                    continue
+
+                categorization.update(result)
+                missing = [e for e in batch if e['image_file'] not in result]
+                if missing:
+                    failed.append(missing)
+        pending = failed
+
+    if pending:
+        left = sum(len(batch) for batch in pending)
+        print(f"Could not categorize {left} receipts; they will be retried on the next run.")
+
+    return categorization
+
+
+def categorize_item_batch(batch, known_categories):
+    agent = ExpenseAgents().item_categorizer_agent()
+    task = ExpenseTasks().categorize_items_task(agent, batch, known_categories)
+
+    try:
+        return run_task(agent, task, lambda text: parse_item_categories(text, batch))
+    except Exception as e:
+        print(f"Item categorizer failed on a batch of {len(batch)}: {e}")
+        return None
+
+
+def categorize_items(store, categorization, image_files=None, use_llm=True, export=True):
+    # Fill in items[*].category, for all receipts or just image_files.
+    # Descriptions are normalized and looked up in the learned dictionary in
+    # one vectorized pass; only descriptions it has never seen go to the LLM,
+    # once each, in batches. With use_llm=False only the dictionary is used;
+    # the rest waits for a run that may call Ollama. Returns
+    # {image_file: [(line, description, category)]} of what it categorized;
+    # with export=False the caller merges that into categorized.json later.
+    expenses = store.all() if image_files is None else [store.get(f) for f in image_files if f in store]
+    items = items_table(expenses, categorization)
+    items["key"] = normalize_descriptions(items["description"])
+    todo = items[items["category"].isna() & (items["key"] != "")]
+    if todo.empty:
+        return {}
+
+    rules = ItemRules()
+    categories = todo["key"].map(rules.categories())
+    unseen = todo[categories.isna() & ~todo["key"].isin(rules.attempted)].drop_duplicates("key")
+    rules.stats['rule_hits'] += int(categories.notna().sum())
+
+    index = EmbeddingIndex("items")
+    if use_llm and not unseen.empty and index.sync(rules.rules):
+        matches = index.query(unseen["key"].tolist())
+        if matches:
+            print(f"Nearest-neighbour match for {len(matches)} unseen line items.")
+            near = unseen[unseen["key"].isin(matches)]
+            rules.learn([(d, matches[k][0]) for d, k in zip(near["description"], near["key"])], source="embedding")
+            unseen = unseen[~unseen["key"].isin(matches)]
+            categories = todo["key"].map(rules.categories())
+    unseen_keys = unseen["key"].tolist()
+    unseen = unseen["description"].tolist() if use_llm else []
+
+    if unseen:
+        print(f"Sending {len(unseen)} unseen line items to the item categorizer...")
+        rules.stats['sent_to_llm'] += len(unseen)
+        known = rules.known_categories()
+        batches = [unseen[i:i + CATEGORIZE_ITEMS_BATCH_SIZE] for i in range(0, len(unseen), CATEGORIZE_ITEMS_BATCH_SIZE)]
+
+        with ThreadPoolExecutor(max_workers=CATEGORIZE_WORKERS) as pool:
+            for result in pool.map(lambda batch: categorize_item_batch(batch, known), batches):
+                rules.learn(list((result or {}).items()))
+        # Whatever is still unresolved is not asked about again
+        rules.attempted.update(key for key in unseen_keys if key not in rules.rules)
+        categories = todo["key"].map(rules.categories())
+    rules.save()
+
+    todo = todo.assign(category=categories).dropna(subset=["category"])
+    updated = []
+    categorized = {}
+    for img, group in todo.groupby("image_file", sort=False):
+        expense = store.get(img)
+        expense_items = [dict(item) for item in expense['items']]
+        for line, category in zip(group["line"], group["category"]):
+            expense_items[line]["category"] = category
+        updated.append({**expense, "items": expense_items})
+        categorized[img] = list(zip(group["line"], group["description"], group["category"]))
+
+    if updated:
+        store.append_many(updated)
+        if export:
+            export_categorized(categorized, categorization)
+    print(f"Categorized {len(todo)} line items ({len(unseen)} needed the LLM).")
+    return categorized
+
+
+def analyze_and_advise(summary):
+    agents = ExpenseAgents()
+    tasks_obj = ExpenseTasks()
 
-def run_expense_crew():
-    with open(EXPENSES_FILE, "r") as f:
-        expenses = json.load(f)
+    analyzer = agents.analyzer_agent()
+    advisor = agents.advisor_agent()
+    llm_cache = LLMCache()
 
-    if os.path.exists(OUTPUT_FILE):
-        with open(OUTPUT_FILE, "r") as f:
-            old_data = json.load(f)
-            old_categorization = old_data.get("categorization", {})
-    else:
-        old_categorization = {}
+    print("Step 2: Analyzing spending patterns...")
+    analyze_task = tasks_obj.analyze_task(analyzer, summary)
+    parsed = run_task(analyzer, analyze_task, parse_analysis, llm_cache)
 
-    new_expenses = [e for e in expenses if e['image_file'] not in old_categorization]
+    # Keep whatever fields parsed; fill the rest with defaults
+    analysis = {"insights": [], "anomalies": [], **(parsed or {})}
+    analysis["total_spent"] = summary["total_spent"]
+    analysis["by_category"] = summary["by_category"]
 
-    if not new_expenses:
-        print("No new receipts to analyze. Skipping.")
-        return old_data
+    print(f"Found {len(analysis.get('insights', []))} insights\n")
 
-    print(f"Found {len(new_expenses)} new receipts to analyze.\n")
-    print("="*70)
-    print("STARTING CREWAI MULTI-AGENT ANALYSIS")
-    print("="*70 + "\n")
+    print("Step 3: Generating budget advice...")
+    advise_task = tasks_obj.advise_task(advisor, analysis)
+    parsed = run_task(advisor, advise_task, parse_advice, llm_cache)
 
-    agents = ExpenseAgents()
-    tasks_obj = ExpenseTasks()
+    advice = {"tips": [], "quick_win": "Track your spending daily", **(parsed or {})}
 
-    categorizer = agents.categorizer_agent()
-    analyzer = agents.analyzer_agent()
-    advisor = agents.advisor_agent()
+    return analysis, advice
 
-    print("Step 1: Categorizing NEW expenses...")
 
-    categorize_task = tasks_obj.categorize_task(categorizer, new_expenses)
+def analysis_fingerprint(summary):
+    return hashlib.sha256(json.dumps(summary, sort_keys=True).encode()).hexdigest()
 
-    crew1 = Crew(
-        agents=[categorizer],
-        tasks=[categorize_task],
-        process=Process.sequential,
-        verbose=False
-    )
 
-    cat_result = crew1.kickoff()
+def analysis_inputs_changed(previous, current, threshold=ANALYSIS_CHANGE_THRESHOLD):
+    if not previous:
+        return True
+    if previous.get("fingerprint") == analysis_fingerprint(current):
+        return False
 
-    categorization_new = clean_json_response(cat_result)
-    categorization = {**old_categorization, **categorization_new}
+    base = abs(previous.get("total_spent") or 0)
+    if base == 0:
+        return current["total_spent"] != 0
 
-    print(f"Categorized {len(categorization_new)} new receipts\n")
+    old_categories = previous.get("by_category", {})
+    for cat in set(old_categories) | set(current["by_category"]):
+        shift = abs(current["by_category"].get(cat, 0) - old_categories.get(cat, 0))
+        if shift / base > threshold:
+            return True
+    return False
 
-    print("Step 2: Analyzing spending patterns...")
-    analyze_task = tasks_obj.analyze_task(analyzer, expenses, categorization)
 
-    crew2 = Crew(
-        agents=[analyzer],
-        tasks=[analyze_task],
-        process=Process.sequential,
-        verbose=False
-    )
+def categorize_new_expenses(new_expenses, expenses, old_categorization):
+    rules = MerchantRules()
+    if not rules.rules:
+        rules.learn(expenses, old_categorization)
 
-    analysis_result = crew2.kickoff()
-    analysis = clean_json_response(analysis_result)
+    categorization_new, unknown, avoided = rules.resolve(new_expenses, CATEGORIZE_BATCH_SIZE)
+    print(f"Merchant rules matched {len(categorization_new)} receipts "
+          f"({avoided} LLM calls avoided); {len(unknown)} sent to the categorizer.")
 
-    if not analysis:
-        total = sum((e.get('total') or 0) for e in expenses)
-        analysis = {"total_spent": total, "insights": [], "anomalies": []}
+    if unknown:
+        nearest = nearest_merchant_categories(unknown, rules)
+        if nearest:
+            print(f"Nearest-neighbour match for {len(nearest)} more receipts.")
+            categorization_new.update(nearest)
+            unknown = [e for e in unknown if e['image_file'] not in nearest]
 
-    print(f"Found {len(analysis.get('insights', []))} insights\n")
+    if unknown:
+        llm_categorization = categorize_expenses(unknown)
+        rules.learn(unknown, llm_categorization)
+        categorization_new.update(llm_categorization)
+    rules.save()
 
-    print("Step 3: Generating budget advice...")
-    advise_task = tasks_obj.advise_task(advisor, analysis)
+    return categorization_new
 
-    crew3 = Crew(
-        agents=[advisor],
-        tasks=[advise_task],
-        process=Process.sequential,
-        verbose=False
-    )
 
-    advice_result = crew3.kickoff()
-    advice = clean_json_response(advice_result)
+def update_analysis(old_data, categorization, aggregates):
+    summary = aggregates.summary()
+    previous_inputs = old_data.get("analysis_inputs") if old_data else None
+
+    if old_data and old_data.get("analysis") and not analysis_inputs_changed(previous_inputs, summary):
+        print(f"Category totals moved less than {ANALYSIS_CHANGE_THRESHOLD:.0%}; "
+              "reusing stored analysis and advice.\n")
+        analysis = old_data["analysis"]
+        advice = old_data.get("advice") or {"tips": [], "quick_win": "Track your spending daily"}
+        # Keep comparing against the inputs the stored analysis was made from,
+        # so many small changes still add up to a re-run
+        analysis_inputs = previous_inputs
+    else:
+        analysis, advice = analyze_and_advise(summary)
+        analysis_inputs = {**summary, "fingerprint": analysis_fingerprint(summary)}
 
-    if not advice:
-        advice = {"tips": [], "quick_win": "Track your spending daily"}
+    # Totals come from the aggregates, not from the model's echo of them
+    analysis["total_spent"] = aggregates.total_spent
+    analysis["by_category"] = aggregates.category_totals()
 
     final_output = {
         "categorization": categorization,
         "analysis": analysis,
-        "advice": advice
+        "advice": advice,
+        "analysis_inputs": analysis_inputs
     }
 
-    with open(OUTPUT_FILE, "w") as f:
-        json.dump(final_output, f, indent=2)
+    atomic_write_json(OUTPUT_FILE, final_output)
+    return final_output
+
+
+def run_expense_crew():
+    store = ExpenseStore(EXPENSES_FILE)
+    expenses = store.all()
+
+    old_data = read_json(OUTPUT_FILE)
+    old_categorization = old_data.get("categorization", {}) if old_data else {}
+
+    aggregates = Aggregates()
+    if aggregates.ensure(expenses, old_categorization):
+        aggregates.save()
+
+    new_expenses = [e for e in expenses if e['image_file'] not in old_categorization]
+
+    if not new_expenses:
+        # Set when the worker's watch mode categorized receipts without an analysis
+        stale = old_data and old_data.get("analysis_stale")
+        print("No new receipts; updating the analysis." if stale else "No new receipts to analyze. Skipping.")
+        with timed("run.items"):
+            categorize_items(store, old_categorization, use_llm=False)
+        store.compact()
+        if stale:
+            with timed("run.analysis"):
+                old_data = update_analysis(old_data, old_categorization, aggregates)
+        write_prometheus()
+        return old_data
+
+    print(f"Found {len(new_expenses)} new receipts to analyze.\n")
+    print("="*70)
+    print("STARTING CREWAI MULTI-AGENT ANALYSIS")
+    print("="*70 + "\n")
+
+    print("Step 1: Categorizing NEW expenses...")
+
+    with timed("run.categorize", records=len(new_expenses)):
+        categorization_new = categorize_new_expenses(new_expenses, expenses, old_categorization)
+    categorization = {**old_categorization, **categorization_new}
+
+    aggregates.sync(new_expenses, categorization_new)
+    aggregates.save()
+
+    print(f"Categorized {len(categorization_new)} new receipts\n")
+
+    print("Categorizing line items...")
+    with timed("run.items"):
+        categorize_items(store, categorization)
+    store.compact()
+    print()
+
+    with timed("run.analysis"):
+        final_output = update_analysis(old_data, categorization, aggregates)
+    write_prometheus()
+    analysis = final_output["analysis"]
+    advice = final_output["advice"]
 
     print("="*70)
     print("ANALYSIS COMPLETE")
@@ -132,4 +382,8 @@ def run_expense_crew():
 
 
 if __name__ == "__main__":
+    from jobs import writer_lock
+    from dataset import export_tables
+    lock = writer_lock()
     run_expense_crew()
+    export_tables()
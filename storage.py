@@ -0,0 +1,222 @@
+import os
+import json
+import hashlib
+import tempfile
+from metrics import timed
+
+EXPENSES_FILE = "outputs/expenses.json"
+INDEX_FILE = "outputs/processed_index.jsonl"
+
+
+def read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def atomic_write_json(path, data, indent=2):
+    # Write to a temp file in the same directory and rename it over the target,
+    # so readers never see a half-written file even if we crash mid-dump.
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    with timed("io.write", file=os.path.basename(path)):
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".tmp_", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=indent)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def save_image(folder, name, data):
+    # Store uploaded bytes under their file name; a different receipt reusing
+    # a name (e.g. "image.jpg") gets a hash prefix instead of overwriting.
+    os.makedirs(folder, exist_ok=True)
+    name = os.path.basename(name)
+    path = os.path.join(folder, name)
+
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            same = f.read() == data
+        if not same:
+            name = f"{hashlib.sha256(data).hexdigest()[:8]}_{name}"
+            path = os.path.join(folder, name)
+
+    with open(path, "wb") as f:
+        f.write(data)
+    return name
+
+
+def file_stamp(*paths):
+    # (mtime, size) per file, None when missing; changes whenever any is rewritten
+    stamp = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Expenses keyed by image_file. outputs/expenses.json is a compacted snapshot;
+# every new or updated record is appended as one line to outputs/expenses.jsonl.
+# Loading replays the log over the snapshot (later lines win) and compact()
+# folds the log back into the snapshot with an atomic rename.
+class ExpenseStore:
+    def __init__(self, path=EXPENSES_FILE, compact_every=500):
+        self.path = path
+        self.log_path = os.path.splitext(path)[0] + ".jsonl"
+        self.compact_every = compact_every
+        self.load()
+
+    def load(self):
+        with timed("io.load_expenses") as event:
+            records = self._load()
+            event["records"] = len(records)
+        return records
+
+    def _load(self):
+        self._records = {}
+        for e in read_json(self.path, []):
+            self._records[e["image_file"]] = e
+
+        self._log_count = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "r") as f:
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn line from a crash mid-append, or an append still
+                        # in progress in the writer; skipped, never repaired here
+                        continue
+                    self._records[e["image_file"]] = e
+                    self._log_count += 1
+
+        self._stamp = self._disk_stamp()
+        return self.all()
+
+    def _disk_stamp(self):
+        return file_stamp(self.path, self.log_path)
+
+    def changed_on_disk(self):
+        # True when another process appended or compacted since we last synced
+        return self._disk_stamp() != self._stamp
+
+    def all(self):
+        return list(self._records.values())
+
+    def get(self, image_file):
+        return self._records.get(image_file)
+
+    def __contains__(self, image_file):
+        return image_file in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def append(self, expense):
+        self.append_many([expense])
+
+    def append_many(self, expenses):
+        # One fsync for the whole batch
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+        with timed("io.append", records=len(expenses)), open(self.log_path, "ab+") as f:
+            # Terminate a torn last line left by a crash, so the first new
+            # record doesn't get glued onto it
+            if f.tell() and self._torn_tail(f):
+                f.write(b"\n")
+            f.write("".join(json.dumps(e) + "\n" for e in expenses).encode())
+            f.flush()
+            os.fsync(f.fileno())
+
+        for e in expenses:
+            self._records[e["image_file"]] = e
+        self._log_count += len(expenses)
+        self._stamp = self._disk_stamp()
+
+        if self.compact_every and self._log_count >= self.compact_every:
+            self.compact()
+
+    @staticmethod
+    def _torn_tail(f):
+        end = f.tell()
+        f.seek(end - 1)
+        torn = f.read(1) != b"\n"
+        f.seek(end)
+        return torn
+
+    def compact(self):
+        if self._log_count == 0 and os.path.exists(self.path):
+            return
+        atomic_write_json(self.path, self.all())
+        # Replaying the log again is harmless (upserts), so a crash between
+        # the rename and this remove cannot lose or duplicate records.
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self._log_count = 0
+        self._stamp = self._disk_stamp()
+
+
+# Set of processed receipts keyed by image content hash and by file name, so
+# the scanner can skip both re-runs and renamed copies in O(1). Persisted as an
+# append-only JSON Lines file next to the expense store.
+class ProcessedIndex:
+    def __init__(self, path=INDEX_FILE):
+        self.path = path
+        self.load()
+
+    def load(self):
+        self.by_hash = {}
+        self.files = set()
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.files.add(entry["image_file"])
+                    if entry.get("sha256"):
+                        self.by_hash.setdefault(entry["sha256"], entry["image_file"])
+
+    def has_file(self, image_file):
+        return image_file in self.files
+
+    def lookup(self, digest):
+        return self.by_hash.get(digest)
+
+    def add(self, image_file, digest=None):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"sha256": digest, "image_file": image_file}) + "\n")
+
+        self.files.add(image_file)
+        if digest:
+            self.by_hash.setdefault(digest, image_file)
+
+    def sync(self, expenses, images_dir=None):
+        # Backfill receipts that were stored before the index existed
+        for e in expenses:
+            name = e["image_file"]
+            if name in self.files:
+                continue
+            digest = e.get("sha256")
+            if not digest and images_dir and os.path.exists(os.path.join(images_dir, name)):
+                digest = file_sha256(os.path.join(images_dir, name))
+            self.add(name, digest)
@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import tempfile
+import pandas as pd
+from storage import atomic_write_json
+
+TABLES_DIR = "outputs/tables"
+
+try:
+    import pyarrow  # noqa: F401 - Parquet engine
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+
+def _dates(values):
+    return pd.to_datetime(pd.Series(values, dtype="object"), errors="coerce", format="ISO8601")
+
+
+def _categorical(values):
+    # Built from strings so an all-empty column still round-trips as text
+    return pd.Series(values, dtype="string").astype("category")
+
+
+def _amounts(values):
+    return pd.to_numeric(pd.Series(values, dtype="object"), errors="coerce").astype("float64")
+
+
+def receipts_table(expenses, categorization):
+    # One row per receipt: categorical merchant/category, float64 amounts and
+    # parsed dates (NaT when OCR found none)
+    df = pd.DataFrame({
+        "image_file": pd.Series([e['image_file'] for e in expenses], dtype="string"),
+        "merchant": _categorical([e.get('merchant') or "Unknown" for e in expenses]),
+        "category": _categorical([categorization.get(e['image_file'], {}).get('category') for e in expenses]),
+        "date": _dates([e.get('date') for e in expenses]),
+        "scanned_at": _dates([e.get('scanned_at') for e in expenses]),
+        "total": _amounts([e.get('total') for e in expenses]),
+        "subtotal": _amounts([e.get('subtotal') for e in expenses]),
+        "tax": _amounts([e.get('tax') for e in expenses]),
+        "item_count": pd.Series([len(e.get('items') or []) for e in expenses], dtype="int64"),
+    })
+    # Receipt date when OCR found one, otherwise when it was scanned
+    df["when"] = df["date"].fillna(df["scanned_at"])
+    return df
+
+
+def items_table(expenses, categorization):
+    # One row per line item, carrying its receipt's merchant and category
+    rows = []
+    for e in expenses:
+        receipt_category = categorization.get(e['image_file'], {}).get('category')
+        for line, item in enumerate(e.get('items') or []):
+            rows.append((
+                e['image_file'], e.get('merchant') or "Unknown", receipt_category, line,
+                item.get('description'), item.get('qty'), item.get('unitPrice'),
+                item.get('amount'), item.get('category')
+            ))
+
+    columns = list(zip(*rows)) or [()] * 9
+    return pd.DataFrame({
+        "image_file": pd.Series(columns[0], dtype="string"),
+        "merchant": _categorical(columns[1]),
+        "receipt_category": _categorical(columns[2]),
+        "line": pd.Series(columns[3], dtype="int64"),
+        "description": pd.Series(columns[4], dtype="string"),
+        "qty": _amounts(columns[5]),
+        "unit_price": _amounts(columns[6]),
+        "amount": _amounts(columns[7]),
+        "category": _categorical(columns[8]),
+    })
+
+
+def build_tables(expenses, categorization):
+    return receipts_table(expenses, categorization), items_table(expenses, categorization)
+
+
+def save_tables(receipts, items, version, folder=TABLES_DIR):
+    if not HAS_PARQUET:
+        return False
+
+    os.makedirs(folder, exist_ok=True)
+    version_file = os.path.join(folder, "version.json")
+    if os.path.exists(version_file):
+        os.remove(version_file)
+
+    for name, df in (("receipts", receipts), ("items", items)):
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix=f".tmp_{name}_", suffix=".parquet")
+        os.close(fd)
+        try:
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, os.path.join(folder, f"{name}.parquet"))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    # Written last: tables are only trusted when the version matches
+    atomic_write_json(version_file, {"version": version})
+    return True
+
+
+def tables_current(version, folder=TABLES_DIR):
+    try:
+        with open(os.path.join(folder, "version.json")) as f:
+            saved = json.load(f).get("version")
+    except (OSError, ValueError):
+        return False
+    return saved == json.loads(json.dumps(version))
+
+
+def load_tables(version, folder=TABLES_DIR):
+    # (receipts, items) from Parquet when they were exported from the same
+    # data version, otherwise None
+    if not HAS_PARQUET or not tables_current(version, folder):
+        return None
+
+    try:
+        return (
+            pd.read_parquet(os.path.join(folder, "receipts.parquet")),
+            pd.read_parquet(os.path.join(folder, "items.parquet"))
+        )
+    except (OSError, ValueError):
+        return None
+
+
+if __name__ == "__main__":
+    from dataset import export_tables
+    from jobs import writer_lock
+
+    if not HAS_PARQUET:
+        sys.exit("Exporting tables needs pyarrow: pip install pyarrow")
+
+    lock = writer_lock()
+    if export_tables():
+        print(f"Tables exported to {TABLES_DIR}/")
+    else:
+        print(f"Tables in {TABLES_DIR}/ are up to date.")
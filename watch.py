@@ -0,0 +1,100 @@
+import os
+import time
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    HAS_WATCHDOG = True
+except ImportError:
+    HAS_WATCHDOG = False
+
+WATCH_INTERVAL = float(os.environ.get("WATCH_INTERVAL", 0.5))
+# A file counts as fully written once its size and mtime hold still this long
+WATCH_DEBOUNCE = float(os.environ.get("WATCH_DEBOUNCE", 1.0))
+
+# Browsers, scanners and sync clients write under these names, then rename
+PARTIAL_SUFFIXES = (".tmp", ".part", ".crdownload", ".download", ".partial", "~")
+
+
+def is_candidate(name):
+    return not name.startswith(".") and not name.lower().endswith(PARTIAL_SUFFIXES)
+
+
+if HAS_WATCHDOG:
+    class _Changes(FileSystemEventHandler):
+        def __init__(self, watcher):
+            self.watcher = watcher
+
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            for path in (event.src_path, getattr(event, "dest_path", "")):
+                if path and os.path.dirname(os.path.abspath(path)) == self.watcher.folder:
+                    self.watcher.mark_dirty(os.path.basename(path))
+
+
+# Reports files that appear in a folder once they have stopped changing.
+# With watchdog installed, inotify/FSEvents/ReadDirectoryChangesW say which
+# names to look at; without it each poll is one os.scandir() that only stats
+# names it has not handed out yet.
+class FolderWatcher:
+    def __init__(self, folder, seen=(), debounce=WATCH_DEBOUNCE, use_watchdog=HAS_WATCHDOG):
+        self.folder = os.path.abspath(folder)
+        self.debounce = debounce
+        self.seen = set(seen)
+        self.pending = {}
+        # Filled from watchdog's thread, drained by poll()
+        self.dirty = set()
+        self._dirty_lock = threading.Lock()
+        self.observer = None
+
+        os.makedirs(self.folder, exist_ok=True)
+        if use_watchdog:
+            self.observer = Observer()
+            self.observer.schedule(_Changes(self), self.folder, recursive=False)
+            self.observer.start()
+        # Everything already there is new to us, watchdog or not
+        self._scan = True
+
+    def mark_dirty(self, name):
+        with self._dirty_lock:
+            self.dirty.add(name)
+
+    def _names(self):
+        if self.observer is None or self._scan:
+            self._scan = False
+            with os.scandir(self.folder) as entries:
+                return [e.name for e in entries if e.is_file()]
+        with self._dirty_lock:
+            names, self.dirty = self.dirty, set()
+        return names
+
+    def poll(self):
+        now = time.monotonic()
+        for name in self._names():
+            if name not in self.seen and is_candidate(name):
+                self.pending.setdefault(name, (None, now))
+
+        ready = []
+        for name, (stamp, since) in list(self.pending.items()):
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                # Renamed or deleted before it settled
+                del self.pending[name]
+                continue
+
+            current = (st.st_size, st.st_mtime_ns)
+            if current != stamp:
+                self.pending[name] = (current, now)
+            elif st.st_size and now - since >= self.debounce:
+                del self.pending[name]
+                self.seen.add(name)
+                ready.append(name)
+        return sorted(ready)
+
+    def close(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()